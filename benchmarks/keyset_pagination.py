@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import sqlite3
+import time
+from os import getenv
+from typing import (Callable,
+                    List,
+                    Tuple)
+
+CREATE = 'CREATE TABLE bench_rows (id INTEGER PRIMARY KEY, payload TEXT NOT NULL)'
+OFFSET = 'SELECT id, payload FROM bench_rows ORDER BY id LIMIT {limit} OFFSET {offset}'
+KEYSET = 'SELECT id, payload FROM bench_rows WHERE id > {last} ORDER BY id LIMIT {limit}'
+
+
+def scan_offset(fetch: Callable[[str], List[Tuple]], limit: int) -> int:
+    offset = rows = 0
+    while True:
+        page = fetch(OFFSET.format(limit=limit, offset=offset))
+        rows += len(page)
+        if len(page) < limit:
+            return rows
+        offset += limit
+
+
+def scan_keyset(fetch: Callable[[str], List[Tuple]], limit: int) -> int:
+    last = rows = 0
+    while True:
+        page = fetch(KEYSET.format(limit=limit, last=last))
+        rows += len(page)
+        if len(page) < limit:
+            return rows
+        last = page[-1][0]
+
+
+def timed(scan: Callable[..., int], *args) -> Tuple[int, float]:
+    start = time.perf_counter()
+    rows = scan(*args)
+    return rows, time.perf_counter() - start
+
+
+def report(name: str, rows: int, limit: int, offset: Tuple[int, float], keyset: Tuple[int, float]):
+    print(f'{name} | rows={rows} | limit={limit}')
+    print(f'  offset | rows={offset[0]} | {offset[1]:.3f}s')
+    print(f'  keyset | rows={keyset[0]} | {keyset[1]:.3f}s | x{offset[1] / keyset[1]:.1f}')
+
+
+def sqlite_bench(rows: int, limit: int):
+    connection = sqlite3.connect(':memory:')
+    connection.execute(CREATE)
+    connection.executemany('INSERT INTO bench_rows VALUES (?, ?)', ((i, f'login{i}') for i in range(1, rows + 1)))
+
+    def fetch(query: str) -> List[Tuple]:
+        return connection.execute(query).fetchall()
+
+    report('sqlite', rows, limit, timed(scan_offset, fetch, limit), timed(scan_keyset, fetch, limit))
+
+
+async def postgres_bench(db_url: str, rows: int, limit: int):
+    import asyncpg
+
+    connection = await asyncpg.connect(db_url)
+    try:
+        await connection.execute(CREATE.replace('CREATE TABLE', 'CREATE TEMPORARY TABLE'))
+        await connection.execute('INSERT INTO bench_rows SELECT i, \'login\' || i FROM generate_series(1, $1) i', rows)
+        await connection.execute('ANALYZE bench_rows')
+        results = {}
+        for name in ('offset', 'keyset'):
+            query = OFFSET if name == 'offset' else KEYSET
+            start = time.perf_counter()
+            total = offset = last = 0
+            while True:
+                page = await connection.fetch(query.format(limit=limit, offset=offset, last=last))
+                total += len(page)
+                if len(page) < limit:
+                    break
+                offset += limit
+                last = page[-1][0]
+            results[name] = (total, time.perf_counter() - start)
+        report('postgres', rows, limit, results['offset'], results['keyset'])
+    finally:
+        await connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Full table scan with LIMIT/OFFSET vs keyset pagination')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--postgres', action='store_true', help='use DB_URL instead of in-memory sqlite')
+    args = parser.parse_args()
+    if args.postgres:
+        asyncio.run(postgres_bench(db_url=getenv('DB_URL'), rows=args.rows, limit=args.limit))
+    else:
+        sqlite_bench(rows=args.rows, limit=args.limit)
+
+
+if __name__ == '__main__':
+    main()
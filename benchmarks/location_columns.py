@@ -0,0 +1,137 @@
+import argparse
+import random
+import sys
+import time
+from datetime import (datetime,
+                      timedelta,
+                      timezone)
+from os import path
+from typing import (Any,
+                    Callable,
+                    Dict,
+                    List,
+                    Tuple)
+
+import numpy as np
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from models.location_columns import LocationColumns  # noqa: E402
+
+
+def to_iso(value: datetime) -> str:
+    return value.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def make_records(sessions: int, hosts: int) -> List[Dict[str, Any]]:
+    begin = datetime.now(timezone.utc) - timedelta(days=30)
+    records = []
+    for location_id in range(1, sessions + 1):
+        begin_at = begin + timedelta(seconds=random.randint(0, 30 * 86400))
+        end_at = begin_at + timedelta(seconds=random.randint(600, 12 * 3600))
+        records.append({'id': location_id, 'host': f'e{random.randint(1, 3)}r{random.randint(1, hosts // 30 or 1)}'
+                                                   f'p{random.randint(1, 30)}',
+                        'campus_id': 1, 'begin_at': to_iso(begin_at),
+                        'end_at': to_iso(end_at) if location_id % 100 else None,
+                        'user': {'id': location_id, 'login': f'login{location_id % 500}'}})
+    return records
+
+
+def get_utc(iso_format: str) -> float:
+    return datetime.fromisoformat(iso_format.replace('Z', '+00:00')).timestamp()
+
+
+def make_rows(records: List[Dict[str, Any]]) -> List[Tuple[int, str, str, int, float, float]]:
+    return [(record['id'], record['host'], record['user']['login'], record['campus_id'],
+             get_utc(record['begin_at']), get_utc(record['end_at'])) for record in records if record['end_at']]
+
+
+def dict_time_stats(records: List[Dict[str, Any]], now: float) -> Tuple[float, int]:
+    total, maximum, hosts = 0.0, 0.0, {}
+    for record in records:
+        seconds = (get_utc(record['end_at']) if record['end_at'] else now) - get_utc(record['begin_at'])
+        maximum = max(maximum, seconds)
+        hosts[record['host']] = hosts.get(record['host'], 0.0) + seconds
+        total += seconds
+    return total, len(hosts)
+
+
+def columns_time_stats(records: List[Dict[str, Any]], now: float) -> Tuple[float, int]:
+    columns = LocationColumns.from_records(location_records=records)
+    durations = columns.durations(now=now)
+    hosts = columns.sum_by_host(values=durations)
+    columns.top_k(values=durations, k=1)
+    return float(durations.sum()), len(hosts)
+
+
+def dict_free_locations(records: List[Dict[str, Any]], active_hosts: List[str]) -> List[str]:
+    hosts = {}
+    for record in records:
+        last = hosts.get(record['host'])
+        if not last or last[1] < record['end_at']:
+            hosts[record['host']] = (record['user']['login'], record['end_at'])
+    free = sorted([(end_at, host, login) for host, (login, end_at) in hosts.items() if host not in active_hosts],
+                  reverse=True)[:400]
+    return [host for _, host, _ in sorted(free, key=lambda entry: entry[1])]
+
+
+def dict_free_rows(rows: List[Tuple[int, str, str, int, float, float]], active_hosts: List[str]) -> List[str]:
+    hosts = {}
+    for _, host, login, _, _, end_at in rows:
+        last = hosts.get(host)
+        if not last or last[1] < end_at:
+            hosts[host] = (login, end_at)
+    free = sorted([(end_at, host, login) for host, (login, end_at) in hosts.items() if host not in active_hosts],
+                  reverse=True)[:400]
+    return [host for _, host, _ in sorted(free, key=lambda entry: entry[1])]
+
+
+def columns_free_locations(records: List[Dict[str, Any]], active_hosts: List[str],
+                           builder: Callable[[Any], LocationColumns] = None) -> List[str]:
+    columns = (builder or LocationColumns.from_records)(records)
+    last = columns.last_by_host()
+    last = last[~np.isin(columns.host_codes[last], columns.get_host_codes(hosts=active_hosts))]
+    free = columns.top_k(values=columns.end_at, k=400, indexes=last)
+    return sorted(columns.hosts[columns.host_codes[i]] for i in free)
+
+
+def timed(function: Callable[..., Any], repeat: int, *args) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(*args)
+    return result, (time.perf_counter() - start) / repeat
+
+
+def report(name: str, dict_result: Tuple[Any, float], columns_result: Tuple[Any, float]):
+    print(f'{name}')
+    print(f'  dict    | {dict_result[1] * 1000:.1f}ms')
+    print(f'  columns | {columns_result[1] * 1000:.1f}ms | x{dict_result[1] / columns_result[1]:.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dict loops vs columnar NumPy processing of location histories')
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--hosts', type=int, default=900)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    random.seed(42)
+    records = make_records(sessions=args.sessions, hosts=args.hosts)
+    closed = [record for record in records if record['end_at']]
+    active_hosts = [record['host'] for record in records if not record['end_at']]
+    now = time.time()
+    print(f'sessions={args.sessions} | hosts={len({record["host"] for record in records})}')
+    report('time stats (durations, per-host sums, maximum)',
+           timed(dict_time_stats, args.repeat, records, now), timed(columns_time_stats, args.repeat, records, now))
+    dict_result = timed(dict_free_locations, args.repeat, closed, active_hosts)
+    columns_result = timed(columns_free_locations, args.repeat, closed, active_hosts)
+    assert sorted(dict_result[0]) == columns_result[0]
+    report('free locations from Intra records (last by host, top 400)', dict_result, columns_result)
+    rows = make_rows(records=records)
+    dict_result = timed(dict_free_rows, args.repeat, rows, active_hosts)
+    columns_result = timed(columns_free_locations, args.repeat, rows, active_hosts, LocationColumns.from_rows)
+    assert sorted(dict_result[0]) == columns_result[0]
+    report('free locations from warehouse rows (last by host, top 400)', dict_result, columns_result)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
+import asyncio
+import logging
 from os import getenv
 from typing import Dict
 
@@ -9,8 +11,12 @@ from cryptography.fernet import Fernet
 import db_models
 from db_models.applications import Application
 from db_models.courses import Courses
+from db_models.location_sessions import LocationSession
 from models.localization import Localization
 from sub_apps.sub_apps import SubApps
+from utils.cache import (CompressedMsgPackSerializer,
+                         listen_invalidations)
+from utils.dispatcher import MessageDispatcher
 from utils.intra_api import IntraAPI
 
 
@@ -34,6 +40,7 @@ class Config:
     db: db_models.Gino = db_models.db
     redis_url = getenv('REDIS_URL', 'redis://localhost:6379')
     redis: RedisCache = None
+    cache_listener: asyncio.Task = None
 
     test = str(getenv('TEST', True)).lower() == 'true'
     intra: IntraAPI = None
@@ -42,17 +49,30 @@ class Config:
     cursus_id: int = None
 
     sub_apps: SubApps = None
+    dispatcher: MessageDispatcher = None
 
     localization = getenv('LOCALIZATION', 'localization.json')
     local: Localization = None
 
     queue: set = set()
+    refresh_queue: set = set()
+    peer_staleness: int = int(getenv('PEER_STALENESS', '3600'))
+    extended_data_timeout: float = float(getenv('EXTENDED_DATA_TIMEOUT', '3'))
+    locations_backfill_days: int = int(getenv('LOCATIONS_BACKFILL_DAYS', '7'))
+    locations_sync_interval: int = int(getenv('LOCATIONS_SYNC_INTERVAL', '300'))
+    not_found_ttl: int = int(getenv('NOT_FOUND_TTL', '600'))
 
     @classmethod
     async def start(cls):
         cls.fernet = Fernet(cls.salt.encode())
         await db_models.db.set_bind(bind=cls.db_url, min_size=1)
+        try:
+            await db_models.db.gino.create_all(tables=[LocationSession.__table__], checkfirst=True)
+        except Exception as e:
+            logging.getLogger('Config').error('Create location_sessions error | %s | warehouse disabled', e)
         cls.redis = Cache.from_url(cls.redis_url)
+        cls.redis.serializer = CompressedMsgPackSerializer()
+        cls.cache_listener = asyncio.create_task(listen_invalidations(redis_url=cls.redis_url))
         cls.application = await Application.get_main() if not cls.test else await Application.get_test()
         cls.intra = IntraAPI(config=cls)
         await cls.intra.load()
@@ -61,10 +81,14 @@ class Config:
         cls.cursus_id = [cursus.id for cursus in courses if cursus.is_primary][0]
         cls.local = Localization()
         cls.local.load(data=read_json(cls.localization))
+        cls.dispatcher = MessageDispatcher()
+        cls.dispatcher.start()
         cls.sub_apps = SubApps(intra=cls.intra, local=cls.local)
 
     @classmethod
     async def stop(cls):
         await cls.db.pop_bind().close()
+        cls.cache_listener.cancel()
+        cls.dispatcher.stop()
         await cls.redis.close()
-        await cls.intra.session.close()
+        await cls.intra.close()
@@ -0,0 +1,26 @@
+from typing import (Any,
+                    AsyncIterator,
+                    Callable,
+                    List,
+                    Sequence,
+                    Tuple)
+
+from sqlalchemy import tuple_
+from sqlalchemy.sql import Select
+
+
+async def keyset_iterate(query: Select, columns: Sequence[Any], key: Callable[[Any], Tuple],
+                         loader: Any = None, limit: int = 100, start: Tuple = None) -> AsyncIterator[List[Any]]:
+    last = start
+    while True:
+        page = query
+        if last is not None:
+            page = page.where(tuple_(*columns) > tuple_(*last))
+        page = page.order_by(*columns).limit(limit)
+        result = await (page.gino.load(loader).all() if loader is not None else page.gino.all())
+        if not result:
+            return
+        yield result
+        if len(result) < limit:
+            return
+        last = key(result[-1])
@@ -0,0 +1,89 @@
+from datetime import (datetime,
+                      timezone)
+from typing import (Any,
+                    Dict,
+                    List,
+                    Optional,
+                    Tuple)
+
+from sqlalchemy.dialects.postgresql import insert
+
+from . import db
+
+
+class LocationSession(db.Model):
+    __tablename__ = 'location_sessions'
+
+    id = db.Column(db.Integer(), primary_key=True)
+    host = db.Column(db.String(50), nullable=False, index=True)
+    login = db.Column(db.String(50), nullable=False, index=True)
+    peer_id = db.Column(db.Integer(), nullable=False)
+    campus_id = db.Column(db.Integer(), nullable=False, index=True)
+    begin_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    end_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    _host_begin_at = db.Index('location_sessions_host_begin_at', 'host', 'begin_at')
+    _login_begin_at = db.Index('location_sessions_login_begin_at', 'login', 'begin_at')
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.to_dict()})'
+
+    @staticmethod
+    def _to_datetime(iso_format: Optional[str]) -> Optional[datetime]:
+        if iso_format:
+            return datetime.fromisoformat(iso_format.replace('Z', '+00:00'))
+
+    @staticmethod
+    def _to_iso(value: Optional[datetime]) -> Optional[str]:
+        if value:
+            return value.astimezone(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'host': self.host,
+            'campus_id': self.campus_id,
+            'begin_at': self._to_iso(self.begin_at),
+            'end_at': self._to_iso(self.end_at),
+            'user': {'id': self.peer_id, 'login': self.login}
+        }
+
+    @classmethod
+    async def save_sessions(cls, locations: List[Dict[str, Any]]):
+        rows = {location['id']: {
+            'id': location['id'],
+            'host': location['host'],
+            'login': location['user']['login'],
+            'peer_id': location['user']['id'],
+            'campus_id': location['campus_id'],
+            'begin_at': cls._to_datetime(location['begin_at']),
+            'end_at': cls._to_datetime(location['end_at'])
+        } for location in locations}
+        rows = list(rows.values())
+        for start in range(0, len(rows), 1000):
+            query = insert(cls.__table__).values(rows[start:start + 1000])
+            query = query.on_conflict_do_update(index_elements=[cls.id], set_={'end_at': query.excluded.end_at,
+                                                                               'host': query.excluded.host})
+            await query.gino.status()
+
+    @classmethod
+    async def get_peer_sessions(cls, login: str, limit: int = None,
+                                begin_at: str = None) -> List['LocationSession']:
+        query = cls.query.where(cls.login == login)
+        if begin_at:
+            query = query.where(cls.begin_at >= cls._to_datetime(begin_at))
+        query = query.order_by(cls.begin_at.desc())
+        if limit:
+            query = query.limit(limit)
+        return await query.gino.all()
+
+    @classmethod
+    async def get_campus_ended_rows(cls, campus_id: int,
+                                    end_at: datetime) -> List[Tuple[int, str, str, int, float, float]]:
+        query = db.select([cls.id, cls.host, cls.login, cls.campus_id, db.func.date_part('epoch', cls.begin_at),
+                           db.func.date_part('epoch', cls.end_at)])
+        return await query.where((cls.campus_id == campus_id) & (cls.end_at > end_at)).gino.all()
+
+    @classmethod
+    async def get_host_sessions(cls, host: str, limit: int) -> List['LocationSession']:
+        return await cls.query.where(cls.host == host).order_by(cls.begin_at.desc()).limit(limit).gino.all()
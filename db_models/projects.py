@@ -7,8 +7,7 @@ import asyncpg.exceptions
 from sqlalchemy.sql import expression
 
 from utils.cache import (Cache,
-                         cache,
-                         del_cache)
+                         cache)
 from . import db
 
 
@@ -39,28 +38,25 @@ class Project(db.Model):
         return project
 
     @classmethod
-    @cache(serialization=True, deserialization=True)
+    @cache(ttl=604800, serialization=True, deserialization=True, key_fields=('project_id',), namespace='Project')
     async def get_project(cls, project_id: int) -> 'Project':
         return await cls.get(project_id)
 
     @classmethod
-    @cache(serialization=True, deserialization=True)
+    @cache(ttl=604800, serialization=True, deserialization=True, key_fields=('cursus_id',),
+           namespace='Project.cursus:{cursus_id}')
     async def get_projects(cls, cursus_id: int) -> List['Project']:
         return await cls.query.where(
             (cls.cursus_id == cursus_id) & (cls.from_intra.is_(True))).order_by(cls.name).gino.all()
 
     @classmethod
-    @del_cache(keys=['Project.get_project'])
     async def create_project(cls, project_id: int, name: str, cursus_id: int, from_intra: bool = False) -> 'Project':
-        await Cache().delete(key=f'Project.get_projects:{cursus_id}')
         with suppress(asyncpg.exceptions.UniqueViolationError):
             return await cls.create(id=project_id, name=name, cursus_id=cursus_id, from_intra=from_intra)
 
     @classmethod
-    @del_cache(keys=['Project.get_projects'])
     async def delete_projects_from_cursus(cls, cursus_id: int, project_ids: List[int]):
         async with db.transaction():
             await cls.update.values(cursus_id=None).where(
                 (cls.cursus_id == cursus_id) & (cls.id.notin_(project_ids))).gino.status()
-        for project_id in project_ids:
-            await Cache().delete(key=f'Project.get_project:{project_id}')
+        await Cache().bump('Project', f'Project.cursus:{cursus_id}')
@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS location_sessions (
+    id INTEGER PRIMARY KEY,
+    host VARCHAR(50) NOT NULL,
+    login VARCHAR(50) NOT NULL,
+    peer_id INTEGER NOT NULL,
+    campus_id INTEGER NOT NULL,
+    begin_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    end_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS ix_location_sessions_host ON location_sessions (host);
+CREATE INDEX IF NOT EXISTS ix_location_sessions_login ON location_sessions (login);
+CREATE INDEX IF NOT EXISTS ix_location_sessions_campus_id ON location_sessions (campus_id);
+CREATE INDEX IF NOT EXISTS location_sessions_host_begin_at ON location_sessions (host, begin_at);
+CREATE INDEX IF NOT EXISTS location_sessions_login_begin_at ON location_sessions (login, begin_at);
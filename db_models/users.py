@@ -54,7 +54,7 @@ class User(db.Model, TimeMixin):
         return user
 
     @classmethod
-    @cache(serialization=True, deserialization=True)
+    @cache(serialization=True, deserialization=True, tags=lambda user, peer_id: [f'User:{user.id}'] if user else [])
     async def get_user_from_peer(cls, peer_id: int) -> 'User':
         return await cls.query.select_from(Peer.join(User)).where(Peer.id == peer_id).gino.first()
 
@@ -69,7 +69,7 @@ class User(db.Model, TimeMixin):
         return await Peer.query.select_from(Peer.join(cls)).where(where).gino.load(Peer.login).first()
 
     @classmethod
-    @cache(serialization=True, is_user_data=True)
+    @cache(serialization=True, is_user_data=True, memoize=True, tags=lambda user_data, user_id: [f'User:{user_id}'])
     async def get_user_data(cls, user_id: int) -> Tuple[Campus, Peer, 'User']:
         query = db.select([Campus, Peer, cls]).select_from(Campus.join(Peer).join(cls)).where(Peer.user_id == user_id)
         return await query.gino.load((Campus, Peer, cls)).first()
@@ -84,7 +84,6 @@ class User(db.Model, TimeMixin):
     @classmethod
     async def update_user(cls, user_id: int, **kwargs) -> 'User':
         _, peer, user = await cls.get_user_data(user_id=user_id)
-        keys = [f'User.get_user_data:{user_id}', f'User.get_user_from_peer:{peer.id}']
         await user.update(**kwargs).apply()
-        [await Cache().delete(key=key) for key in keys]
+        await Cache().delete_many(keys=[f'User.get_user_from_peer:{peer.id}'], tags=[f'User:{user_id}'])
         return user
@@ -1,13 +1,88 @@
+import logging
+from contextlib import suppress
 from enum import Enum
 from typing import (Any,
                     Dict,
-                    List)
+                    Iterable,
+                    List,
+                    Set)
 
 from utils.cache import (cache,
-                         del_cache)
+                         del_cache,
+                         request_memo)
 from . import db
+from .keyset import keyset_iterate
 from .peers import Peer
 
+MARK_DIRTY_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('SADD', KEYS[2], ARGV[1])
+end
+return 1
+'''
+
+RELATIONSHIP_SCRIPT = '''
+local user_id = ARGV[2]
+local peer_id = ARGV[3]
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('SADD', KEYS[2], user_id)
+end
+if ARGV[1] == 'add' then
+    redis.call('SADD', KEYS[3], peer_id)
+    if #KEYS > 3 then
+        redis.call('SADD', KEYS[4], user_id)
+        redis.call('SADD', KEYS[5], peer_id)
+    end
+else
+    redis.call('SREM', KEYS[3], peer_id)
+    if #KEYS > 3 then
+        redis.call('SREM', KEYS[4], user_id)
+        if redis.call('SCARD', KEYS[4]) == 0 then
+            redis.call('SREM', KEYS[5], peer_id)
+        end
+    end
+end
+return redis.call('SCARD', KEYS[3])
+'''
+
+REINDEX_SCRIPT = '''
+local user_id = ARGV[1]
+local friends = tonumber(ARGV[2])
+for _, peer_id in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+    local watchers = ARGV[3] .. peer_id
+    redis.call('SREM', watchers, user_id)
+    if redis.call('SCARD', watchers) == 0 then
+        redis.call('SREM', KEYS[3], peer_id)
+    end
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+for i = 4, #ARGV do
+    if i < 4 + friends then
+        redis.call('SADD', KEYS[1], ARGV[i])
+    else
+        redis.call('SADD', KEYS[2], ARGV[i])
+        redis.call('SADD', ARGV[3] .. ARGV[i], user_id)
+        redis.call('SADD', KEYS[3], ARGV[i])
+    end
+end
+return 1
+'''
+
+COUNT_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+return redis.call('SCARD', KEYS[2])
+'''
+
+WATCHERS_SCRIPT = '''
+local watchers = {}
+for i = 1, #KEYS do
+    watchers[i] = redis.call('SMEMBERS', KEYS[i])
+end
+return watchers
+'''
+
 
 class Relationship(Enum):
     friend = 'friend'
@@ -24,8 +99,123 @@ class UserPeer(db.Model):
 
     _uniq = db.UniqueConstraint('user_id', 'peer_id', 'relationship')
 
+    indexed_key = 'UserPeer.indexed'
+    building_key = 'UserPeer.building'
+    dirty_key = 'UserPeer.dirty'
+    observed_key = 'UserPeer.observed'
+    watchers_prefix = 'UserPeer.watchers:'
+
+    @staticmethod
+    def _redis():
+        from config import Config
+        return Config.redis
+
+    @staticmethod
+    def _relationship_key(user_id: int, relationship: Relationship) -> str:
+        return f'UserPeer.{relationship.value}:{user_id}'
+
+    @classmethod
+    async def _index(cls, action: str, user_id: int, peer_id: int, relationship: Relationship):
+        keys = [cls.building_key, cls.dirty_key, cls._relationship_key(user_id=user_id, relationship=relationship)]
+        if relationship is Relationship.observable:
+            keys.extend((f'{cls.watchers_prefix}{peer_id}', cls.observed_key))
+        try:
+            await cls._redis().raw('eval', RELATIONSHIP_SCRIPT, keys=keys, args=[action, user_id, peer_id])
+        except Exception as e:
+            logging.getLogger('UserPeer').error('Relationships index error | %s | %s | drop index', user_id, e)
+            with suppress(Exception):
+                await cls._redis().raw('delete', cls.indexed_key)
+
+    @classmethod
+    async def _set_index(cls, user_id: int, friends: List[int], observables: List[int]):
+        keys = [cls._relationship_key(user_id=user_id, relationship=Relationship.friend),
+                cls._relationship_key(user_id=user_id, relationship=Relationship.observable),
+                cls.observed_key]
+        args = [user_id, len(friends), cls.watchers_prefix, *friends, *observables]
+        await cls._redis().raw('eval', REINDEX_SCRIPT, keys=keys, args=args)
+
+    @classmethod
+    async def reindex_user(cls, user_id: int):
+        await cls._redis().raw('eval', MARK_DIRTY_SCRIPT, keys=[cls.building_key, cls.dirty_key], args=[user_id])
+        await cls._reindex_user(user_id=user_id)
+
+    @classmethod
+    async def _reindex_user(cls, user_id: int):
+        rows = await db.select([cls.peer_id, cls.relationship]).where(cls.user_id == user_id).gino.all()
+        await cls._set_index(user_id=user_id,
+                             friends=[peer_id for peer_id, relationship in rows if relationship is Relationship.friend],
+                             observables=[peer_id for peer_id, relationship in rows
+                                          if relationship is Relationship.observable])
+
+    @classmethod
+    async def _get_indexed_users(cls) -> Set[int]:
+        users = set()
+        for relationship in Relationship:
+            cursor = 0
+            while True:
+                cursor, keys = await cls._redis().raw('scan', cursor, match=f'UserPeer.{relationship.value}:*',
+                                                      count=1000)
+                users.update(int(key.decode().rsplit(':', 1)[1]) for key in keys)
+                if not cursor:
+                    break
+        return users
+
+    @classmethod
+    async def build_index(cls, ttl: int = 86400) -> int:
+        redis = cls._redis()
+        await redis.raw('set', cls.building_key, 1, expire=3600)
+        await redis.raw('delete', cls.dirty_key)
+        relationships = {}
+        query = db.select([cls.id, cls.user_id, cls.peer_id, cls.relationship])
+        async for rows in keyset_iterate(query=query, columns=(cls.id,), key=lambda row: (row[0],), limit=1000):
+            for _, user_id, peer_id, relationship in rows:
+                relationships.setdefault(user_id, {Relationship.friend: [], Relationship.observable: []})
+                relationships[user_id][relationship].append(peer_id)
+        for user_id, peers in relationships.items():
+            await cls._set_index(user_id=user_id, friends=peers[Relationship.friend],
+                                 observables=peers[Relationship.observable])
+        for user_id in await cls._get_indexed_users() - set(relationships):
+            await cls._set_index(user_id=user_id, friends=[], observables=[])
+        while True:
+            dirty = await redis.raw('spop', cls.dirty_key, 100)
+            if not dirty:
+                break
+            for user_id in dirty:
+                await cls._reindex_user(user_id=int(user_id))
+        await redis.raw('delete', cls.building_key)
+        await redis.raw('set', cls.indexed_key, 1, expire=ttl)
+        return len(relationships)
+
+    @classmethod
+    async def is_indexed(cls) -> bool:
+        return bool(await cls._redis().raw('exists', cls.indexed_key))
+
+    @classmethod
+    async def get_observed(cls) -> List[int]:
+        return [int(peer_id) for peer_id in await cls._redis().raw('smembers', cls.observed_key)]
+
+    @classmethod
+    async def get_watchers(cls, peer_ids: Iterable[int]) -> Dict[int, List[int]]:
+        peer_ids = list(peer_ids)
+        if not peer_ids:
+            return {}
+        keys = [f'{cls.watchers_prefix}{peer_id}' for peer_id in peer_ids]
+        watchers = await cls._redis().raw('eval', WATCHERS_SCRIPT, keys=keys)
+        return {peer_id: sorted(int(user_id) for user_id in user_ids) for peer_id, user_ids in zip(peer_ids, watchers)}
+
+    @classmethod
+    async def _get_count(cls, user_id: int, relationship: Relationship) -> int:
+        relationships = (request_memo.get() or {}).get(f'UserPeer._get_relationships:{user_id}')
+        if relationships is None:
+            count = await cls._redis().raw('eval', COUNT_SCRIPT, keys=[
+                cls.indexed_key, cls._relationship_key(user_id=user_id, relationship=relationship)])
+            if count >= 0:
+                return count
+            relationships = await cls._get_relationships(user_id=user_id)
+        return len(relationships[f'{relationship.value}s'])
+
     @classmethod
-    @cache()
+    @cache(memoize=True)
     async def _get_relationships(cls, user_id: int) -> Dict[str, List[Dict[str, Any]]]:
         query = db.select([Peer, cls]).select_from(Peer.join(cls)).where(cls.user_id == user_id).order_by(cls.id)
         result = await query.gino.load((Peer, cls)).all()
@@ -39,12 +229,13 @@ class UserPeer(db.Model):
 
     @classmethod
     async def get_friends_count(cls, user_id: int) -> int:
-        return len(await cls.get_friends(user_id=user_id))
+        return await cls._get_count(user_id=user_id, relationship=Relationship.friend)
 
     @classmethod
     @del_cache(keys=['UserPeer._get_relationships'])
     async def add_friend(cls, user_id: int, peer_id: int):
         await cls.create(user_id=user_id, peer_id=peer_id, relationship=Relationship.friend)
+        await cls._index(action='add', user_id=user_id, peer_id=peer_id, relationship=Relationship.friend)
 
     @classmethod
     @del_cache(keys=['UserPeer._get_relationships'])
@@ -52,6 +243,7 @@ class UserPeer(db.Model):
         await cls.delete.where(
             (cls.user_id == user_id) & (cls.peer_id == peer_id) & (cls.relationship == Relationship.friend)
         ).gino.status()
+        await cls._index(action='remove', user_id=user_id, peer_id=peer_id, relationship=Relationship.friend)
 
     @classmethod
     async def get_friends(cls, user_id: int) -> List[Peer]:
@@ -60,12 +252,13 @@ class UserPeer(db.Model):
 
     @classmethod
     async def get_observed_count(cls, user_id: int) -> int:
-        return len(await cls.get_observables(user_id=user_id))
+        return await cls._get_count(user_id=user_id, relationship=Relationship.observable)
 
     @classmethod
     @del_cache(keys=['UserPeer._get_relationships'])
     async def add_observable(cls, user_id: int, peer_id: int):
         await cls.create(user_id=user_id, peer_id=peer_id, relationship=Relationship.observable)
+        await cls._index(action='add', user_id=user_id, peer_id=peer_id, relationship=Relationship.observable)
 
     @classmethod
     @del_cache(keys=['UserPeer._get_relationships'])
@@ -73,6 +266,7 @@ class UserPeer(db.Model):
         await cls.delete.where(
             (cls.user_id == user_id) & (cls.peer_id == peer_id) & (cls.relationship == Relationship.observable)
         ).gino.status()
+        await cls._index(action='remove', user_id=user_id, peer_id=peer_id, relationship=Relationship.observable)
 
     @classmethod
     async def get_observables(cls, user_id: int) -> List[Peer]:
@@ -1,8 +1,10 @@
-from aiogram.types import Message
+from aiogram.types import (CallbackQuery,
+                           Message)
 
 from bot import dp
 from config import Config
 from services.states import States
+from utils.broadcast import Broadcast
 from utils.helpers import AdminProcesses
 
 
@@ -12,17 +14,28 @@ async def mailing(message: Message):
     if message.text == '$':
         await message.answer('Отменено')
     else:
-        await message.answer('Рассылка началась')
-        await AdminProcesses().sending_messages(message=message)
-        await message.answer('Готово!')
+        await Broadcast().create(message=message)
 
 
 @dp.message_handler(is_mailing=True, state='*')
 async def before_mailing(message: Message):
+    broadcast = Broadcast()
+    if await broadcast.is_active():
+        await broadcast.report(new_message=True)
+        return
     await dp.current_state(user=Config.admin).set_state(States.MAILING)
     await message.answer("Пришли сообщение, которое надо разослать, или отправь $ для отмены")
 
 
+@dp.callback_query_handler(lambda callback_query: callback_query.from_user.id == Config.admin,
+                           text_startswith='broadcast', state='*')
+async def broadcast_actions(callback_query: CallbackQuery):
+    action = callback_query.data.split('.')[-1]
+    statuses = {'pause': 'paused', 'resume': 'running', 'cancel': 'cancelled'}
+    await callback_query.answer()
+    await Broadcast().set_status(status=statuses[action])
+
+
 @dp.message_handler(state='update_projects', content_types=['document', 'text'])
 async def update_projects(message: Message):
     await dp.current_state(user=message.from_user.id).set_state(States.GRANTED)
@@ -1,13 +1,9 @@
-import asyncio
 from contextlib import suppress
 from typing import Tuple
 
 from aiogram.types import Message
 from aiogram.utils.exceptions import (MessageCantBeDeleted,
-                                      MessageNotModified,
-                                      MessageToDeleteNotFound,
-                                      MessageToEditNotFound,
-                                      RetryAfter)
+                                      MessageToDeleteNotFound)
 
 from bot import (bot,
                  dp)
@@ -90,17 +86,10 @@ async def friends_data(message: Message, user_data: Tuple[Campus, Peer, User]):
     friends = await UserPeer.get_friends(user_id=user.id)
     friends_count = await UserPeer.get_friends_count(user_id=user.id)
     observables = await UserPeer.get_observables(user_id=user.id)
-    for i, friend in enumerate(friends[:10], 1):
-        await message.bot.send_chat_action(user.id, 'typing')
-        texts[0] = Config.local.friends_list.get(user.language, from_=1, to=i, friends_count=friends_count)
-        peer, text = await text_compile.peer_data_compile(user=user, login=friend.login, is_single=False)
-        texts.append(text)
-        try:
-            with suppress(MessageNotModified, MessageToEditNotFound):
-                await message.edit_text('\n\n'.join(texts), disable_web_page_preview=True)
-        except RetryAfter as e:
-            await message.answer(str(e))
-            await asyncio.sleep(e.timeout)
+    await message.bot.send_chat_action(user.id, 'typing')
+    texts[0] = Config.local.friends_list.get(user.language, from_=1, to=len(friends[:10]),
+                                             friends_count=friends_count)
+    texts.extend([text for _, text in await text_compile.peers_data_compile(user=user, peers=friends[:10])])
     text = '\n\n'.join(texts)
     await Cache().set(key=f'Friends:{user.id}:1', value=texts)
     keyboard = peer_keyboard(peers=friends[:10], friends=friends[:10], observables=observables,
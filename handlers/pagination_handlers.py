@@ -1,4 +1,3 @@
-import asyncio
 from contextlib import suppress
 from typing import Tuple
 
@@ -6,8 +5,7 @@ from aiogram.types import CallbackQuery
 from aiogram.utils.exceptions import (MessageCantBeDeleted,
                                       MessageNotModified,
                                       MessageToDeleteNotFound,
-                                      MessageToEditNotFound,
-                                      RetryAfter)
+                                      MessageToEditNotFound)
 from aiogram.utils.parts import paginate
 
 from bot import (bot,
@@ -152,18 +150,10 @@ async def friends_pagination(callback_query: CallbackQuery, user_data: Tuple[Cam
     friends = paginate(friends, page=page, limit=10)
     friends_count = await UserPeer.get_friends_count(user_id=user.id)
     observables = await UserPeer.get_observables(user_id=user.id)
-    for i, friend in enumerate(friends, page * 10 + 1):
-        await callback_query.message.bot.send_chat_action(user.id, 'typing')
-        texts[0] = Config.local.friends_list.get(user.language, from_=page * 10 + 1, to=i, friends_count=friends_count)
-        peer, text = await text_compile.peer_data_compile(user=user, login=friend.login, is_single=False)
-        texts.append(text)
-        if not i % 3:
-            try:
-                with suppress(MessageNotModified, MessageToEditNotFound):
-                    await callback_query.message.edit_text('\n\n'.join(texts), disable_web_page_preview=True)
-            except RetryAfter as e:
-                await callback_query.message.answer(str(e))
-                await asyncio.sleep(e.timeout)
+    await callback_query.message.bot.send_chat_action(user.id, 'typing')
+    texts[0] = Config.local.friends_list.get(user.language, from_=page * 10 + 1, to=page * 10 + len(friends),
+                                             friends_count=friends_count)
+    texts.extend([text for _, text in await text_compile.peers_data_compile(user=user, peers=friends)])
     text = '\n\n'.join(texts)
     await Cache().set(key=f'Friends:{user.id}:{page + 1}', value=texts)
     keyboard = peer_keyboard(peers=friends, friends=friends, observables=observables,
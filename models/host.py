@@ -1,13 +1,20 @@
+import logging
 from dataclasses import dataclass
 from typing import (Any,
+                    Awaitable,
+                    Callable,
                     Dict,
-                    List)
+                    List,
+                    Optional)
 
 from config import Config
+from db_models.location_sessions import LocationSession
+from db_models.peers import Peer
 
 
 @dataclass
 class Host:
+    id: int = 0
     end_at: str = ''
     begin_at: str = ''
     host: str = ''
@@ -17,20 +24,77 @@ class Host:
 
     @staticmethod
     def from_dict(data: Dict[str, Any]) -> 'Host':
+        id = data['id']
         end_at = data['end_at']
         begin_at = data['begin_at']
         host = data['host']
         campus_id = data['campus_id']
         login = data['user']['login']
         peer_id = data['user']['id']
-        return Host(end_at=end_at, begin_at=begin_at, host=host, campus_id=campus_id, login=login, peer_id=peer_id)
+        return Host(id=id, end_at=end_at, begin_at=begin_at, host=host, campus_id=campus_id, login=login, peer_id=peer_id)
+
+    async def _get_local(self, keys: List[str], loader: Callable[[], Awaitable[List[LocationSession]]],
+                         login: str = None) -> Optional[List['Host']]:
+        locations_sync = Config.sub_apps.locations_sync
+        for key in keys:
+            if await locations_sync.is_covered(key=key):
+                break
+        else:
+            return None
+        try:
+            sessions = await loader()
+            campuses = {session.campus_id for session in sessions}
+            if login:
+                campuses.add(await Peer.select('campus_id').where(Peer.login == login).gino.scalar())
+        except Exception as e:
+            logging.getLogger('Host').error('Read location sessions error | %s | %s', keys[-1], e)
+            return None
+        if campuses and campuses <= await locations_sync.get_synced_campuses():
+            return self._from_list(location_records=[session.to_dict() for session in sessions])
+
+    @staticmethod
+    async def _save(key: Optional[str], location_records: List[Dict[str, Any]]):
+        try:
+            await LocationSession.save_sessions(locations=location_records)
+            if key:
+                await Config.sub_apps.locations_sync.cover(key=key, locations=location_records)
+        except Exception as e:
+            logging.getLogger('Host').error('Save location sessions error | %s | %s', key, e)
 
     async def get_peer_locations(self, login: str, all_locations: bool = False) -> List['Host']:
+        keys = [f'login_all:{login}'] if all_locations else [f'login_all:{login}', f'login:{login}']
+        limit = None if all_locations else 50
+        locations = await self._get_local(keys=keys,
+                                          loader=lambda: LocationSession.get_peer_sessions(login=login, limit=limit),
+                                          login=login)
+        if locations is not None:
+            return locations
         peer_locations = await Config.intra.get_peer_locations(login=login, all_locations=all_locations)
+        await self._save(key=keys[-1], location_records=peer_locations)
+        return self._from_list(location_records=peer_locations)
+
+    async def get_peers_locations(self, peer_ids: List[int]) -> List['Host']:
+        peers_locations = await Config.intra.get_peers_locations(peer_ids=sorted(peer_ids))
+        return self._from_list(location_records=peers_locations)
+
+    async def get_peer_locations_since(self, login: str, begin_at: str) -> List['Host']:
+        locations = await self._get_local(keys=[f'login_all:{login}'],
+                                          loader=lambda: LocationSession.get_peer_sessions(login=login,
+                                                                                           begin_at=begin_at),
+                                          login=login)
+        if locations is not None:
+            return locations
+        peer_locations = await Config.intra.get_peer_locations_since(login=login, begin_at=begin_at)
+        await self._save(key=None, location_records=peer_locations)
         return self._from_list(location_records=peer_locations)
 
     async def get_location_history(self, host: str) -> List['Host']:
+        locations = await self._get_local(keys=[f'host:{host}'],
+                                          loader=lambda: LocationSession.get_host_sessions(host=host, limit=10))
+        if locations is not None:
+            return locations
         location_records = await Config.intra.get_location_history(host=host)
+        await self._save(key=f'host:{host}', location_records=location_records)
         return self._from_list(location_records=location_records)
 
     def _from_list(self, location_records: List[Dict[str, Any]]) -> List['Host']:
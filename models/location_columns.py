@@ -0,0 +1,97 @@
+import time
+from datetime import (datetime,
+                      timezone)
+from typing import (Any,
+                    Dict,
+                    Iterable,
+                    List,
+                    Optional,
+                    Tuple)
+
+import numpy as np
+
+
+class LocationColumns:
+    def __init__(self, ids: np.ndarray, begin_at: np.ndarray, end_at: np.ndarray, host_codes: np.ndarray,
+                 campus_ids: np.ndarray, hosts: List[str], logins: List[str]):
+        self.ids = ids
+        self.begin_at = begin_at
+        self.end_at = end_at
+        self.host_codes = host_codes
+        self.campus_ids = campus_ids
+        self.hosts = hosts
+        self.logins = logins
+        self._host_codes = {host: code for code, host in enumerate(hosts)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def to_epoch(iso_formats: Iterable[Optional[str]]) -> np.ndarray:
+        values = np.array([iso_format.rstrip('Z') if iso_format else 'NaT' for iso_format in iso_formats],
+                          dtype='datetime64[ms]')
+        epochs = values.astype('int64') / 1000
+        epochs[np.isnat(values)] = np.nan
+        return epochs
+
+    @staticmethod
+    def to_iso(epoch: float) -> str:
+        return datetime.fromtimestamp(epoch, timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+    @classmethod
+    def from_columns(cls, ids: List[int], hosts: List[str], logins: List[str], campus_ids: List[int],
+                     begin_at: np.ndarray, end_at: np.ndarray) -> 'LocationColumns':
+        host_codes = {}
+        codes = np.array([host_codes.setdefault(host, len(host_codes)) for host in hosts], dtype=np.int64)
+        return cls(ids=np.array(ids, dtype=np.int64), begin_at=begin_at, end_at=end_at, host_codes=codes,
+                   campus_ids=np.array(campus_ids, dtype=np.int64), hosts=list(host_codes), logins=logins)
+
+    @classmethod
+    def from_records(cls, location_records: List[Dict[str, Any]]) -> 'LocationColumns':
+        return cls.from_columns(ids=[data['id'] for data in location_records],
+                                hosts=[data['host'] for data in location_records],
+                                logins=[data['user']['login'] for data in location_records],
+                                campus_ids=[data['campus_id'] for data in location_records],
+                                begin_at=cls.to_epoch([data['begin_at'] for data in location_records]),
+                                end_at=cls.to_epoch([data['end_at'] for data in location_records]))
+
+    @classmethod
+    def from_hosts(cls, locations: List[Any]) -> 'LocationColumns':
+        return cls.from_columns(ids=[location.id for location in locations],
+                                hosts=[location.host for location in locations],
+                                logins=[location.login for location in locations],
+                                campus_ids=[location.campus_id for location in locations],
+                                begin_at=cls.to_epoch([location.begin_at for location in locations]),
+                                end_at=cls.to_epoch([location.end_at for location in locations]))
+
+    @classmethod
+    def from_rows(cls, rows: List[Tuple[int, str, str, int, float, Optional[float]]]) -> 'LocationColumns':
+        ids, hosts, logins, campus_ids, begin_at, end_at = list(zip(*rows)) or [()] * 6
+        return cls.from_columns(ids=ids, hosts=hosts, logins=list(logins), campus_ids=campus_ids,
+                                begin_at=np.array(begin_at, dtype=np.float64),
+                                end_at=np.array(end_at, dtype=np.float64))
+
+    def durations(self, now: float = None) -> np.ndarray:
+        return np.where(np.isnan(self.end_at), now or time.time(), self.end_at) - self.begin_at
+
+    def sum_by_host(self, values: np.ndarray) -> Dict[str, Tuple[float, int]]:
+        sums = np.bincount(self.host_codes, weights=values, minlength=len(self.hosts))
+        campuses = np.zeros(len(self.hosts), dtype=np.int64)
+        campuses[self.host_codes] = self.campus_ids
+        return {host: (float(seconds), int(campus_id))
+                for host, seconds, campus_id in zip(self.hosts, sums, campuses)}
+
+    def get_host_codes(self, hosts: Iterable[str]) -> np.ndarray:
+        return np.array([self._host_codes[host] for host in hosts if host in self._host_codes], dtype=np.int64)
+
+    def last_by_host(self) -> np.ndarray:
+        order = np.lexsort((np.nan_to_num(self.end_at, nan=np.inf), self.host_codes))
+        codes = self.host_codes[order]
+        return order[np.append(codes[1:] != codes[:-1], True)] if len(order) else order
+
+    @staticmethod
+    def top_k(values: np.ndarray, k: int, indexes: np.ndarray = None) -> np.ndarray:
+        indexes = np.arange(len(values)) if indexes is None else indexes
+        if len(indexes) > k:
+            indexes = indexes[np.argpartition(-values[indexes], k - 1)[:k]]
+        return indexes[np.argsort(-values[indexes], kind='stable')]
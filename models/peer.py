@@ -1,16 +1,21 @@
+import asyncio
 from dataclasses import (dataclass,
                          field)
 from datetime import (datetime,
                       timezone)
 from typing import (Any,
+                    Awaitable,
                     Dict,
                     List,
                     Tuple,
-                    Optional)
+                    Optional,
+                    Union)
 
 from config import Config
+from db_models.peers import Peer as PeerDB
 from db_models.users import User
 from models.host import Host
+from utils.intra_api import IntraAPIError
 from utils.savers import Savers
 
 
@@ -56,6 +61,13 @@ class Peer:
     username: str = ''
     projects_users: List[Dict[str, Any]] = field(default_factory=list)
 
+    @staticmethod
+    async def _degrade(awaitable: Awaitable[Any], default: Any = None) -> Any:
+        try:
+            return await asyncio.wait_for(awaitable, timeout=Config.extended_data_timeout)
+        except (asyncio.TimeoutError, IntraAPIError):
+            return default
+
     @staticmethod
     async def _get_coalition(login: str) -> str:
         coalitions = await Config.intra.get_peer_coalitions(login=login)
@@ -64,6 +76,36 @@ class Peer:
             coalition = await Savers.get_coalition(coalition_id=coalition_id)
             return coalition.name
 
+    @staticmethod
+    async def _get_coalitions(peer_ids: List[int]) -> Dict[int, str]:
+        coalitions_users = await Config.intra.get_peers_coalitions(peer_ids=sorted(peer_ids))
+        coalition_ids = {}
+        for coalition_user in coalitions_users:
+            coalition_ids.setdefault(coalition_user['user_id'], coalition_user['coalition_id'])
+        coalitions = await asyncio.gather(*[Savers.get_coalition(coalition_id=coalition_id)
+                                            for coalition_id in set(coalition_ids.values())])
+        names = {coalition.id: coalition.name for coalition in coalitions}
+        return {peer_id: names[coalition_id] for peer_id, coalition_id in coalition_ids.items()}
+
+    @staticmethod
+    async def _get_last_locations(peer_ids: List[int]) -> Dict[int, List[Host]]:
+        last_locations = {}
+        for location in await Host().get_peers_locations(peer_ids=peer_ids):
+            last_locations.setdefault(location.peer_id, [location])
+        return last_locations
+
+    @staticmethod
+    def _get_last_seen(locations: List[Host], location: str, status: str) -> Tuple[str, str, str, str]:
+        last_location = ''
+        last_seen_time = ''
+        if locations:
+            last_seen_time = locations[0].end_at
+            last_location = locations[0].host
+            if not last_seen_time:
+                location = locations[0].host
+                status = '🟢 '
+        return status, location, last_location, last_seen_time
+
     @staticmethod
     async def _get_username(peer_id: int) -> str:
         user = await User.get_user_from_peer(peer_id=peer_id)
@@ -74,16 +116,16 @@ class Peer:
                                  status: str) -> Tuple[str, str, str, str, str, str]:
         last_location = ''
         last_seen_time = ''
+        locations, coalition, username = await asyncio.gather(
+            self._degrade(Host().get_peer_locations(login=login)) if not location else asyncio.sleep(0),
+            self._degrade(self._get_coalition(login=login)),
+            self._degrade(self._get_username(peer_id=peer_id))
+        )
         if not location:
-            locations = await Host().get_peer_locations(login=login)
-            if locations:
-                last_seen_time = locations[0].end_at
-                last_location = locations[0].host
-                if not last_seen_time:
-                    location = locations[0].host
-                    status = '🟢 '
-        coalition = await self._get_coalition(login=login) or ''
-        username = await self._get_username(peer_id=peer_id) or ''
+            status, location, last_location, last_seen_time = \
+                self._get_last_seen(locations=locations, location=location, status=status)
+        coalition = coalition or ''
+        username = username or ''
         return status, location, last_location, last_seen_time, coalition, username
 
     async def get_peer(self, login: str, extended: bool = True) -> 'Peer':
@@ -127,8 +169,38 @@ class Peer:
                 status = '😎 '
             projects_users = sorted(peer_data['projects_users'], key=lambda project: project['id'], reverse=True)
             await Savers.get_peer(peer_id=id, login=login, cursus_id=cursus_id, campus_id=campus_id)
+            Config.sub_apps.known_logins.add(logins=[login])
             return Peer(id=id, login=login, full_name=full_name, pool_month=pool_month, pool_year=pool_year,
                         coalition=coalition, cursus_data=cursus_data, cursus_id=cursus_id, campus=campus,
                         campus_id=campus_id, time_zone=time_zone, location=location, last_location=last_location,
                         avatar=avatar, link=link, status=status, last_seen_time=last_seen_time, is_staff=is_staff,
                         dignity=dignity, username=username, projects_users=projects_users)
+
+    async def get_peers(self, peers: List[PeerDB]) -> List[Union['Peer', Exception]]:
+        peer_ids = [peer.id for peer in peers]
+        results, coalitions, last_locations = await asyncio.gather(
+            asyncio.gather(*[self.get_peer(login=peer.login, extended=False) for peer in peers],
+                           return_exceptions=True),
+            self._degrade(self._get_coalitions(peer_ids=peer_ids), default={}),
+            self._degrade(self._get_last_locations(peer_ids=peer_ids), default={})
+        )
+        offline = [peer for peer in results if isinstance(peer, Peer) and not peer.location]
+        missed = [peer for peer in offline if peer.id not in last_locations]
+        missed_locations = await asyncio.gather(*[self._degrade(Host().get_peer_locations(login=peer.login))
+                                                  for peer in missed])
+        for peer, locations in zip(missed, missed_locations):
+            if locations is not None:
+                last_locations[peer.id] = locations
+        usernames = await asyncio.gather(*[self._degrade(self._get_username(peer_id=peer_id)) for peer_id in peer_ids])
+        for peer, username in zip(results, usernames):
+            if not isinstance(peer, Peer):
+                continue
+            if not peer.location:
+                peer.status, peer.location, peer.last_location, peer.last_seen_time = \
+                    self._get_last_seen(locations=last_locations.get(peer.id), location=peer.location,
+                                        status=peer.status)
+            if peer.is_staff:
+                peer.status = '😎 '
+            peer.coalition = coalitions.get(peer.id, '')
+            peer.username = username or ''
+        return results
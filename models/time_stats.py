@@ -0,0 +1,81 @@
+from dataclasses import (dataclass,
+                         field,
+                         replace)
+from typing import (Any,
+                    Dict,
+                    List)
+
+from models.host import Host
+from models.location_columns import LocationColumns
+from utils.cache import Cache
+
+
+@dataclass
+class TimeStats:
+    login: str = ''
+    mark: str = ''
+    folded: Dict[int, str] = field(default_factory=dict)
+    total: float = 0.0
+    hosts: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    maximum: Dict[str, Any] = field(default_factory=lambda: {'seconds': 0})
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> 'TimeStats':
+        folded = {int(location_id): begin_at for location_id, begin_at in data['folded'].items()}
+        return TimeStats(login=data['login'], mark=data['mark'], folded=folded, total=data['total'],
+                         hosts=data['hosts'], maximum=data['maximum'])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'login': self.login,
+            'mark': self.mark,
+            'folded': self.folded,
+            'total': self.total,
+            'hosts': self.hosts,
+            'maximum': self.maximum
+        }
+
+    def _add(self, locations: List[Host]):
+        if not locations:
+            return
+        columns = LocationColumns.from_hosts(locations=locations)
+        durations = columns.durations()
+        for host, (seconds, campus_id) in columns.sum_by_host(values=durations).items():
+            self.hosts.setdefault(host, {'seconds': 0, 'campus_id': campus_id})
+            self.hosts[host]['seconds'] += seconds
+        self.total += float(durations.sum())
+        longest, = columns.top_k(values=durations, k=1)
+        if self.maximum['seconds'] < durations[longest]:
+            location = locations[longest]
+            self.maximum = {
+                'host': location.host, 'campus_id': location.campus_id, 'seconds': float(durations[longest]),
+                'end_at': location.end_at, 'begin_at': location.begin_at
+            }
+
+    def _fold(self, locations: List[Host]) -> List[Host]:
+        opened = [location for location in locations if not location.end_at]
+        closed = list({location.id: location for location in locations
+                       if location.end_at and location.id not in self.folded}.values())
+        self._add(locations=closed)
+        self.folded.update({location.id: location.begin_at for location in closed})
+        marks = [location.begin_at for location in opened] or [*self.folded.values(), self.mark]
+        self.mark = min(marks) if opened else max(marks)
+        self.folded = {location_id: begin_at for location_id, begin_at in self.folded.items()
+                       if begin_at >= self.mark}
+        return opened
+
+    async def get_time_stats(self, login: str) -> 'TimeStats':
+        key = f'TimeStats:{login}'
+        data = await Cache().get(key=key)
+        if data is None:
+            stats = TimeStats(login=login)
+            locations = await Host().get_peer_locations(login=login, all_locations=True)
+        else:
+            stats = self.from_dict(data=data)
+            locations = await Host().get_peer_locations_since(login=login, begin_at=stats.mark)
+        opened = stats._fold(locations=locations)
+        if stats.mark:
+            await Cache().set(key=key, value=stats.to_dict(), ttl=2592000)
+        view = replace(stats, hosts={host: dict(data) for host, data in stats.hosts.items()})
+        view._add(locations=opened)
+        return view
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from datetime import (datetime,
+                      timedelta,
+                      timezone)
+from typing import (List,
+                    Set,
+                    Tuple)
+
+import numpy as np
+
+from db_models.location_sessions import LocationSession
+from models.location_columns import LocationColumns
+from utils.cache import (Cache,
+                         single_flight)
+from utils.intra_api import IntraAPI
+
+SWAP_INDEX_SCRIPT = '''
+redis.call('DEL', KEYS[2])
+if #ARGV > 1 then
+    for i = 2, #ARGV, 1000 do
+        redis.call('RPUSH', KEYS[2], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+    end
+    redis.call('RENAME', KEYS[2], KEYS[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+else
+    redis.call('DEL', KEYS[1])
+end
+return 1
+'''
+
+
+class FreeLocations:
+    campuses_key = 'FreeLocations.campuses'
+
+    def __init__(self, intra: IntraAPI):
+        from config import Config
+        self._config = Config
+        self._intra = intra
+        self._logger = logging.getLogger('FreeLocations')
+
+    @staticmethod
+    def _index_key(campus_id: int) -> str:
+        return f'FreeLocations.index:{campus_id}'
+
+    @staticmethod
+    def _meta_key(campus_id: int) -> str:
+        return f'FreeLocations.meta:{campus_id}'
+
+    async def _load(self, campus_id: int, past: datetime,
+                    now: datetime) -> Tuple[float, LocationColumns, Set[str]]:
+        active = await self._config.sub_apps.locations_sync.get_active(campus_id=campus_id)
+        if active is not None:
+            scan, locations = active
+            rows = await LocationSession.get_campus_ended_rows(campus_id=campus_id, end_at=past)
+            return scan, LocationColumns.from_rows(rows=rows), set(locations.values())
+        scan = time.time()
+        inactive, active = await asyncio.gather(
+            self._intra.get_campus_inactive_locations(campus_id=campus_id, begin_at=past, end_at=now),
+            self._intra.get_campus_active_locations(campus_id=campus_id))
+        return scan, LocationColumns.from_records(location_records=inactive), {location['host'] for location in active}
+
+    async def _refresh(self, campus_id: int):
+        now = datetime.now(timezone.utc)
+        scan, columns, active_hosts = await self._load(campus_id=campus_id, past=now - timedelta(hours=24), now=now)
+        last = columns.last_by_host()
+        last = last[~np.isin(columns.host_codes[last], columns.get_host_codes(hosts=active_hosts))]
+        free = sorted(columns.top_k(values=columns.end_at, k=400, indexes=last),
+                      key=lambda i: columns.hosts[columns.host_codes[i]])
+        entries = [f'{columns.hosts[columns.host_codes[i]]} {columns.logins[i]} {columns.to_iso(columns.end_at[i])}'
+                   for i in free]
+        index_key = self._index_key(campus_id=campus_id)
+        await self._config.redis.raw('eval', SWAP_INDEX_SCRIPT, keys=[index_key, f'{index_key}:new'],
+                                     args=[3600, *entries])
+        await self._config.redis.set(key=self._meta_key(campus_id=campus_id),
+                                     value={'scan': scan, 'active': len(active_hosts)}, ttl=3600)
+        self._logger.info('Refresh free locations | campus=%s | inactive=%s | active=%s | free=%s',
+                          campus_id, len(columns), len(active_hosts), len(entries))
+
+    async def _locked_refresh(self, campus_id: int, lock_ttl: int = 60):
+        meta_key = self._meta_key(campus_id=campus_id)
+        for _ in range(lock_ttl * 10):
+            if await Cache().lock(key=meta_key, ttl=lock_ttl):
+                try:
+                    return await self._refresh(campus_id=campus_id)
+                finally:
+                    await Cache().unlock(key=meta_key)
+            await asyncio.sleep(0.1)
+            if await self._config.redis.get(key=meta_key):
+                return
+
+    async def refresh(self, campus_id: int):
+        await single_flight(key=f'FreeLocations.refresh:{campus_id}',
+                            coroutine=lambda: self._locked_refresh(campus_id=campus_id))
+
+    async def get_page(self, campus_id: int, page: int,
+                       limit: int = 40) -> Tuple[float, int, int, int, List[Tuple[str, str, str]]]:
+        await self._config.redis.raw('zadd', self.campuses_key, time.time(), campus_id)
+        meta = await self._config.redis.get(key=self._meta_key(campus_id=campus_id))
+        if not meta:
+            await self.refresh(campus_id=campus_id)
+            meta = await self._config.redis.get(key=self._meta_key(campus_id=campus_id))
+        index_key = self._index_key(campus_id=campus_id)
+        total = await self._config.redis.raw('llen', index_key)
+        count = total - page * limit
+        while count <= 0 and page:
+            page -= 1
+            count = total - page * limit
+        entries = await self._config.redis.raw('lrange', index_key, page * limit, (page + 1) * limit - 1)
+        entries = [tuple(entry.decode().split(' ', 2)) for entry in entries]
+        return meta['scan'], meta['active'], max(count, 0), page, entries
+
+    async def get_campuses(self) -> List[int]:
+        await self._config.redis.raw('zremrangebyscore', self.campuses_key, float('-inf'),
+                                     time.time() - 3600)
+        return [int(campus_id) for campus_id in await self._config.redis.raw('zrange', self.campuses_key, 0, -1)]
@@ -0,0 +1,46 @@
+import asyncio
+import logging
+import sys
+from typing import (Iterable,
+                    Set)
+
+from db_models import db
+from db_models.location_sessions import LocationSession
+from db_models.peers import Peer
+from utils.intra_api import IntraAPI
+
+
+class KnownLogins:
+    def __init__(self, intra: IntraAPI):
+        from config import Config
+        self._config = Config
+        self._intra = intra
+        self._logger = logging.getLogger('KnownLogins')
+        self._logins: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._logins)
+
+    def __contains__(self, login: str) -> bool:
+        return login in self._logins
+
+    def add(self, logins: Iterable[str]):
+        self._logins.update(sys.intern(login) for login in logins)
+
+    async def _load(self):
+        peers = await db.select([Peer.login]).gino.all()
+        sessions = await db.select([LocationSession.login]).distinct().gino.all()
+        self.add(logins=[login for login, in peers])
+        self.add(logins=[login for login, in sessions])
+
+    async def is_not_found(self, login: str) -> bool:
+        return login not in self._logins and await self._intra.is_not_found(login=login)
+
+    async def updater(self, interval: int = 3600):
+        while True:
+            try:
+                await self._load()
+                self._logger.info('Load known logins | logins=%s', len(self))
+            except Exception as e:
+                self._logger.error('Load known logins error | %s', e)
+            await asyncio.sleep(interval)
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from datetime import (datetime,
+                      timedelta,
+                      timezone)
+from typing import (Any,
+                    Dict,
+                    List,
+                    Optional,
+                    Set,
+                    Tuple)
+
+from db_models import db
+from db_models.location_sessions import LocationSession
+from db_models.peers import Peer
+from db_models.users_peers import (Relationship,
+                                   UserPeer)
+from utils.cache import Cache
+from utils.intra_api import (IntraAPI,
+                             NotFoundIntraError,
+                             TimeoutIntraError,
+                             UnknownIntraError)
+from utils.rate_limiter import (Lane,
+                                lane)
+
+
+class LocationsSync:
+    since_key = 'LocationsSync.since'
+    watermark_key = 'LocationsSync.watermark'
+    covered_key = 'LocationsSync.covered'
+
+    def __init__(self, intra: IntraAPI):
+        from config import Config
+        self._config = Config
+        self._intra = intra
+        self._logger = logging.getLogger('LocationsSync')
+
+    @staticmethod
+    def _active_key(campus_id: int) -> str:
+        return f'LocationsSync.active:{campus_id}'
+
+    async def _get_campuses(self, viewed: List[int]) -> Dict[int, int]:
+        users = db.select([Peer.campus_id]).where(
+            Peer.user_id.isnot(None) & Peer.campus_id.isnot(None)).distinct()
+        observed = db.select([Peer.campus_id]).select_from(Peer.join(UserPeer)).where(
+            (UserPeer.relationship == Relationship.observable) & Peer.campus_id.isnot(None)).distinct()
+        campuses = {campus_id: 1 for campus_id, in await observed.gino.all()}
+        campuses.update({campus_id: 1 for campus_id in viewed})
+        campuses.update({campus_id: self._config.locations_backfill_days
+                         for campus_id, in await users.gino.all()})
+        return campuses
+
+    async def get_synced_campuses(self) -> Set[int]:
+        return {int(campus_id) for campus_id in await self._config.redis.raw('hkeys', self.since_key)}
+
+    async def get_active(self, campus_id: int) -> Optional[Tuple[float, Dict[str, str]]]:
+        snapshot = await self._config.redis.get(key=self._active_key(campus_id=campus_id))
+        if snapshot:
+            return snapshot['scan'], {login: host for login, (_, host) in snapshot['locations'].items()}
+
+    async def is_covered(self, key: str) -> bool:
+        return bool(await self._config.redis.raw('sismember', self.covered_key, key))
+
+    async def cover(self, key: str, locations: List[Dict[str, Any]]):
+        campuses = {location['campus_id'] for location in locations}
+        if campuses and campuses <= await self.get_synced_campuses():
+            await self._config.redis.raw('sadd', self.covered_key, key)
+
+    async def _publish_active(self, campus_id: int, scan: float, active: List[Dict[str, Any]],
+                              ended: List[Dict[str, Any]]):
+        key = self._active_key(campus_id=campus_id)
+        previous = await self._config.redis.get(key=key) or {'locations': {}, 'carried': []}
+        ended_ids = {location['id'] for location in ended}
+        locations = {location['user']['login']: [location['id'], location['host']] for location in active}
+        carried = [login for login, (location_id, _) in previous['locations'].items()
+                   if login not in locations and login not in previous['carried'] and location_id not in ended_ids]
+        for login in carried:
+            locations[login] = previous['locations'][login]
+        await self._config.redis.set(key=key, value={'scan': scan, 'locations': locations, 'carried': carried},
+                                     ttl=self._config.locations_sync_interval * 3)
+        if carried:
+            self._logger.info('Carry missed active sessions | campus=%s | logins=%s', campus_id, carried)
+
+    async def _campus_sync(self, campus_id: int, backfill_days: int):
+        now = datetime.now(timezone.utc)
+        watermark = await self._config.redis.raw('hget', self.watermark_key, campus_id)
+        if watermark is None:
+            since = begin_at = now - timedelta(days=backfill_days)
+            self._logger.info('Start campus backfill | campus=%s | since=%s', campus_id, since)
+        else:
+            begin_at = datetime.fromisoformat(watermark.decode()) - timedelta(minutes=5)
+        ended, active = await asyncio.gather(
+            self._intra.get_campus_locations_window(campus_id=campus_id, field='end_at',
+                                                    begin_at=begin_at, end_at=now),
+            self._intra.get_campus_active_locations(campus_id=campus_id))
+        await LocationSession.save_sessions(locations=[*ended, *active])
+        self._config.sub_apps.known_logins.add(logins=[location['user']['login'] for location in [*ended, *active]])
+        if watermark is None:
+            await self._config.redis.raw('hset', self.since_key, campus_id, since.isoformat())
+        await self._config.redis.raw('hset', self.watermark_key, campus_id, now.isoformat())
+        await self._publish_active(campus_id=campus_id, scan=now.timestamp(), active=active, ended=ended)
+        self._logger.info('Complete campus sync | campus=%s | ended=%s | active=%s', campus_id, len(ended), len(active))
+
+    async def _campus_process(self, campus_id: int, backfill_days: int, viewed: bool):
+        if not await Cache().lock(key=f'LocationsSync:{campus_id}', ttl=self._config.locations_sync_interval):
+            return
+        try:
+            await self._campus_sync(campus_id=campus_id, backfill_days=backfill_days)
+            if viewed:
+                await self._config.sub_apps.free_locations.refresh(campus_id=campus_id)
+        except (NotFoundIntraError, TimeoutIntraError, UnknownIntraError) as e:
+            self._logger.error('Error response | campus=%s | %s', campus_id, e)
+        except Exception as e:
+            self._logger.error('Unknown locations sync error | campus=%s | %s', campus_id, e)
+
+    async def sync(self):
+        lane.set(Lane.maintenance)
+        while True:
+            try:
+                viewed = await self._config.sub_apps.free_locations.get_campuses()
+                campuses = await self._get_campuses(viewed=viewed)
+                stopped = await self.get_synced_campuses() - set(campuses)
+                for campus_id in stopped:
+                    self._logger.info('Stop campus sync | campus=%s', campus_id)
+                    await self._config.redis.raw('hdel', self.since_key, campus_id)
+                    await self._config.redis.raw('hdel', self.watermark_key, campus_id)
+                    await self._config.redis.raw('delete', self._active_key(campus_id=campus_id))
+                if stopped:
+                    await self._config.redis.raw('delete', self.covered_key)
+                for campus_id, backfill_days in campuses.items():
+                    await self._campus_process(campus_id=campus_id, backfill_days=backfill_days,
+                                               viewed=campus_id in viewed)
+            except Exception as e:
+                self._logger.error('Unknown locations sync error | %s', e)
+            await asyncio.sleep(self._config.locations_sync_interval)
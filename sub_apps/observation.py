@@ -2,11 +2,13 @@ import asyncio
 from datetime import (datetime,
                       timezone)
 import logging
-from typing import (Dict,
+from typing import (AsyncIterator,
+                    Dict,
                     List,
                     Tuple)
 
 from db_models import db
+from db_models.keyset import keyset_iterate
 from db_models.peers import Peer
 from db_models.users import (User,
                              Languages)
@@ -20,56 +22,80 @@ from utils.intra_api import (IntraAPI,
                              TimeoutIntraError,
                              UnknownIntraError)
 from utils.cache import Cache
+from utils.dispatcher import Priority
+from utils.rate_limiter import (Lane,
+                                lane)
 
 
 class Observation:
     def __init__(self, intra: IntraAPI, local: Localization):
+        from config import Config
         from utils.helpers import AdminProcesses
+        self._config = Config
         self._intra = intra
         self._local = local
         self._logger = logging.getLogger('Observation')
         self._mailing = AdminProcesses(logger=self._logger).mailing
 
     @staticmethod
-    async def _get_observables(limit: int, offset: int) -> List[Tuple[str, List[int]]]:
-        return await db.select([Peer.login, db.func.array_agg(UserPeer.user_id)]).select_from(
-            Peer.join(UserPeer)).where(UserPeer.relationship == Relationship.observable).limit(limit).offset(
-            offset).group_by(Peer.id).gino.all()
+    async def _iter_observables(limit: int) -> AsyncIterator[List[Tuple[int, str, int, List[int]]]]:
+        if not await UserPeer.is_indexed():
+            query = db.select([Peer.id, Peer.login, Peer.campus_id, db.func.array_agg(UserPeer.user_id)]).select_from(
+                Peer.join(UserPeer)).where(UserPeer.relationship == Relationship.observable).group_by(Peer.id)
+            async for observables in keyset_iterate(query=query, columns=(Peer.id,), key=lambda row: (row[0],),
+                                                    limit=limit):
+                yield observables
+            return
+        peer_ids = sorted(await UserPeer.get_observed())
+        for start in range(0, len(peer_ids), limit):
+            watchers = await UserPeer.get_watchers(peer_ids=peer_ids[start:start + limit])
+            peers = await Peer.query.where(Peer.id.in_(list(watchers))).order_by(Peer.id).gino.all()
+            yield [(peer.id, peer.login, peer.campus_id, watchers[peer.id]) for peer in peers if watchers[peer.id]]
 
     @staticmethod
-    async def _get_notifiable(limit: int, offset: int) -> Tuple[int, int, str, List[int]]:
+    def _iter_notifiable(limit: int) -> AsyncIterator[List[Tuple[int, int, str, List[int]]]]:
         query = db.select(
             [Peer.campus_id, Peer.cursus_id, Campus.time_zone, db.func.array_agg(User.id)]).select_from(
             Peer.join(User).join(Campus)).where(
             (User.notify.is_(True)) & (Peer.cursus_id.isnot(None)) & (Peer.campus_id.isnot(None))
-        ).limit(limit).offset(offset).order_by(Peer.campus_id, Peer.cursus_id)
-        return await query.group_by(Peer.campus_id, Peer.cursus_id, Campus.time_zone).gino.first()
+        ).group_by(Peer.campus_id, Peer.cursus_id, Campus.time_zone)
+        return keyset_iterate(query=query, columns=(Peer.campus_id, Peer.cursus_id),
+                              key=lambda row: (row[0], row[1]), limit=limit)
 
-    async def _mailing_observations(self, user_ids: List[int], login: str, location: str, left_peer: bool = False):
-        for user_id in user_ids:
-            self._logger.info('Trying to send notification | %s | %s', login, user_id)
-            user_data = await User.get_user_data(user_id=user_id)
-            if user_data:
-                _, peer, user = user_data
-                if left_peer and user.left_peer:
-                    text = self._local.left_workplace.get(user.language, login=login, old_location=location)
-                    await self._mailing(message=text, user=user, peer_id=peer.id)
-                else:
-                    text = self._local.in_campus.get(user.language, login=login, current_location=location)
-                    await self._mailing(message=text, user=user, peer_id=peer.id)
+    async def _mailing_observation(self, user_id: int, login: str, location: str, left_peer: bool):
+        self._logger.info('Trying to send notification | %s | %s', login, user_id)
+        user_data = await User.get_user_data(user_id=user_id)
+        if user_data:
+            _, peer, user = user_data
+            if left_peer and user.left_peer:
+                text = self._local.left_workplace.get(user.language, login=login, old_location=location)
+                await self._mailing(message=text, user=user, peer_id=peer.id, priority=Priority.notification)
             else:
-                self._logger.error('User not found | %s', user_id)
+                text = self._local.in_campus.get(user.language, login=login, current_location=location)
+                await self._mailing(message=text, user=user, peer_id=peer.id, priority=Priority.notification)
+        else:
+            self._logger.error('User not found | %s', user_id)
+
+    async def _mailing_observations(self, user_ids: List[int], login: str, location: str, left_peer: bool = False):
+        results = await asyncio.gather(*[self._mailing_observation(user_id=user_id, login=login, location=location,
+                                                                   left_peer=left_peer) for user_id in user_ids],
+                                       return_exceptions=True)
+        for user_id, result in zip(user_ids, results):
+            if isinstance(result, Exception):
+                self._logger.error('Failed notification | %s | %s | %s', login, user_id, result)
+
+    async def _mailing_event_notify(self, texts: Dict[Languages, str], user_id: int):
+        user_data = await User.get_user_data(user_id=user_id)
+        self._logger.info('Trying to send event notification | %s ', user_id)
+        if user_data:
+            _, peer, user = user_data
+            text = texts[Languages(user.language)]
+            await self._mailing(message=text, user=user, peer_id=peer.id, priority=Priority.notification)
+        else:
+            self._logger.error('User not found | %s', user_id)
 
     async def _mailing_events_notify(self, texts: Dict[Languages, str], user_ids: List[int]):
-        for user_id in user_ids:
-            user_data = await User.get_user_data(user_id=user_id)
-            self._logger.info('Trying to send event notification | %s ', user_id)
-            if user_data:
-                _, peer, user = user_data
-                text = texts[Languages(user.language)]
-                await self._mailing(message=text, user=user, peer_id=peer.id)
-            else:
-                self._logger.error('User not found | %s', user_id)
+        await asyncio.gather(*[self._mailing_event_notify(texts=texts, user_id=user_id) for user_id in user_ids])
 
     async def _observation_process(self, observables: List[Tuple[str, List[int]]]):
         for login, user_ids in observables:
@@ -104,6 +130,53 @@ class Observation:
             except Exception as e:
                 self._logger.error('Unknown observation error | %s | %s', login, e)
 
+    async def _campus_observation_process(self, campus_id: int, observables: List[Tuple[str, List[int]]]):
+        try:
+            self._logger.info('Start campus observation process | campus=%s | observables=%s',
+                              campus_id, len(observables))
+            active = await self._config.sub_apps.locations_sync.get_active(campus_id=campus_id)
+            if active is None:
+                try:
+                    locations = await self._intra.get_campus_active_locations(campus_id=campus_id)
+                except (NotFoundIntraError, TimeoutIntraError, UnknownIntraError) as e:
+                    self._logger.error('Error response | campus=%s | %s | return', campus_id, e)
+                    return
+                snapshot = {location['user']['login']: location['host'] for location in locations}
+            else:
+                _, snapshot = active
+            previous = await Cache().get(key=f'Observation.locations:{campus_id}')
+            observed = set(await Cache().get(key=f'Observation.observed:{campus_id}') or [])
+            if previous is None:
+                self._logger.info('Save first snapshot | campus=%s', campus_id)
+            else:
+                for login, user_ids in observables:
+                    if login not in observed:
+                        self._logger.info('Save first state | %s | %s', login, snapshot.get(login))
+                        continue
+                    location = previous.get(login)
+                    current_location = snapshot.get(login)
+                    if location == current_location:
+                        continue
+                    try:
+                        self._logger.info('Update location | %s | %s → %s', login, location, current_location)
+                        if current_location:
+                            await self._mailing_observations(user_ids=user_ids, login=login,
+                                                             location=current_location)
+                        else:
+                            await self._mailing_observations(user_ids=user_ids, login=login,
+                                                             location=location, left_peer=True)
+                    except Exception as e:
+                        self._logger.error('Unknown observation error | %s | %s | retry next', login, e)
+                        snapshot.pop(login, None)
+                        if location:
+                            snapshot[login] = location
+            await Cache().set(key=f'Observation.locations:{campus_id}', value=snapshot)
+            await Cache().set(key=f'Observation.observed:{campus_id}', value=[login for login, _ in observables])
+            self._logger.info('Complete campus observation process | campus=%s', campus_id)
+
+        except Exception as e:
+            self._logger.error('Unknown campus observation error | campus=%s | %s', campus_id, e)
+
     async def _events_notify_process(self, notifiable: Tuple[int, int, str, List[int]]):
         from utils.text_compile import text_compile
 
@@ -113,11 +186,14 @@ class Observation:
             try:
                 events_data = await self._intra.get_events(campus_id=campus_id, cursus_id=cursus_id)
                 exams_data = await self._intra.get_exams(campus_id=campus_id, cursus_id=cursus_id)
-                events_data.extend(exams_data)
+                events_data = [*events_data, *exams_data]
             except (NotFoundIntraError, TimeoutIntraError, UnknownIntraError) as e:
                 self._logger.error('Error response | campus=%s | cursus=%s| %s | return', campus_id, cursus_id, e)
                 return
-            events = sorted(Event().from_list(events_data=events_data), key=lambda event: event.begin_at)
+            now = datetime.now(tz=timezone.utc)
+            events = sorted([event for event in Event().from_list(events_data=events_data)
+                             if datetime.fromisoformat(event.begin_at.replace('Z', '+00:00')) > now],
+                            key=lambda event: event.begin_at)
             for event in events:
                 self._logger.info('Start notify | %s | %s | %s', event.id, event.name, event.kind)
                 cache_event = await Cache().get(key=f'Event:{event.kind}:{event.id}:{campus_id}.{cursus_id}')
@@ -131,7 +207,7 @@ class Observation:
                     ttl = (datetime.fromisoformat(event.begin_at.replace('Z', '+00:00')) -
                            datetime.now(tz=timezone.utc)).total_seconds() + 300
                     await Cache().set(key=f'Event:{event.kind}:{event.id}:{campus_id}.{cursus_id}',
-                                      value=True, ttl=int(ttl))
+                                      value=True, ttl=max(int(ttl), 1))
                     self._logger.info('Update notify | %s | %s | %s', event.id, event.name, event.kind)
                 else:
                     self._logger.info('Skip notify | %s | %s | %s', event.id, event.name, event.kind)
@@ -140,15 +216,19 @@ class Observation:
             self._logger.error('Unknown notify error | campus=%s | cursus=%s | %s', campus_id, cursus_id, e)
 
     async def observation(self):
+        lane.set(Lane.notification)
         while True:
             now = datetime.now()
-            offset = 0
-            observables = await self._get_observables(limit=100, offset=offset)
-            while observables:
-                self._logger.info('Start observation for offset=%s', offset)
-                await self._observation_process(observables=observables)
-                offset += 100
-                observables = await self._get_observables(limit=100, offset=offset)
+            campuses = {}
+            async for observables in self._iter_observables(limit=100):
+                for _, login, campus_id, user_ids in observables:
+                    campuses.setdefault(campus_id, []).append((login, user_ids))
+            for campus_id, campus_observables in campuses.items():
+                if campus_id is None:
+                    self._logger.info('Start observation without campus | observables=%s', len(campus_observables))
+                    await self._observation_process(observables=campus_observables)
+                else:
+                    await self._campus_observation_process(campus_id=campus_id, observables=campus_observables)
             self._logger.info('Completed observation')
             passed_seconds = (datetime.now() - now).seconds
             if passed_seconds < 300:
@@ -157,13 +237,11 @@ class Observation:
                 await asyncio.sleep(sleep)
 
     async def event_notify(self):
+        lane.set(Lane.notification)
         while True:
-            offset = 0
-            notifiable = await self._get_notifiable(limit=1, offset=offset)
-            while notifiable:
-                self._logger.info('Start event notify for offset=%s', offset)
-                await self._events_notify_process(notifiable=notifiable)
-                offset += 1
-                notifiable = await self._get_notifiable(limit=1, offset=offset)
+            async for notifiable_batch in self._iter_notifiable(limit=50):
+                for notifiable in notifiable_batch:
+                    self._logger.info('Start event notify | campus=%s | cursus=%s', notifiable[0], notifiable[1])
+                    await self._events_notify_process(notifiable=notifiable)
             self._logger.info('Completed event notify, sleep 1800 seconds')
             await asyncio.sleep(1800)
@@ -3,6 +3,9 @@ import asyncio
 from models.localization import Localization
 from utils.intra_api import IntraAPI
 
+from .free_locations import FreeLocations
+from .known_logins import KnownLogins
+from .locations_sync import LocationsSync
 from .observation import Observation
 from .updater import Updater
 
@@ -12,12 +15,22 @@ class SubApps:
         self.running = []
         self.stalking = Observation(intra=intra, local=local)
         self.updater = Updater(intra=intra)
+        self.free_locations = FreeLocations(intra=intra)
+        self.locations_sync = LocationsSync(intra=intra)
+        self.known_logins = KnownLogins(intra=intra)
 
     async def start(self):
+        from utils.broadcast import Broadcast
+
+        await Broadcast().resume()
         self.running.append(asyncio.create_task(self.stalking.observation()))
         self.running.append(asyncio.create_task(self.stalking.event_notify()))
         self.running.append(asyncio.create_task(self.updater.updater()))
         self.running.append(asyncio.create_task(self.updater.clear_queue()))
+        self.running.append(asyncio.create_task(self.updater.refresher()))
+        self.running.append(asyncio.create_task(self.updater.index_relationships()))
+        self.running.append(asyncio.create_task(self.locations_sync.sync()))
+        self.running.append(asyncio.create_task(self.known_logins.updater()))
 
     async def stop(self):
         for task in self.running:
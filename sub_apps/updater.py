@@ -6,18 +6,25 @@ from aiogram.utils.exceptions import ChatNotFound
 
 from db_models import db
 from db_models.campuses import Campus
+from db_models.keyset import keyset_iterate
 from db_models.peers import Peer
 from db_models.users import User
+from db_models.users_peers import UserPeer
 from services.states import States
-from utils.cache import Cache
+from utils.cache import (Cache,
+                         Invalidation)
 from utils.intra_api import (IntraAPI,
                              NotFoundIntraError,
                              TimeoutIntraError,
                              UnknownIntraError)
+from utils.rate_limiter import (Lane,
+                                lane)
 
 
 class Updater:
     def __init__(self, intra: IntraAPI):
+        from config import Config
+        self._config = Config
         self._intra = intra
         self._logger = logging.getLogger('Updater')
 
@@ -48,41 +55,81 @@ class Updater:
 
         self._logger.info('Start usernames updater')
         async with db.transaction():
-            offset = 0
-            query = db.select([User, Peer]).select_from(User.outerjoin(Peer)).limit(100).offset(offset).order_by(
-                User.id)
-            result = await query.gino.load((User, Peer.id)).all()
-            while result:
-                self._logger.info('Start usernames updater for offset=%s', offset)
+            query = db.select([User, Peer]).select_from(User.outerjoin(Peer))
+            async for result in keyset_iterate(query=query, columns=(User.id,), key=lambda row: (row[0].id,),
+                                               loader=(User, Peer.id)):
+                self._logger.info('Start usernames updater from user=%s', result[0][0].id)
+                invalidation = Invalidation()
                 for user_db, peer_id in result:
                     with suppress(ChatNotFound):
                         user = await bot.get_chat(user_db.id)
                         self._logger.info('Check user | %s [%s]', user.id, user.username)
-                        keys = []
                         if not user.first_name:
-                            keys.extend((
-                                f'Peer.get_peer:{peer_id}',
-                                f'UserPeer._get_relationships:{user.id}',
-                                f'User.get_user_data:{user.id}',
-                                f'User.get_user_from_peer:{peer_id}'))
+                            invalidation.add(f'Peer.get_peer:{peer_id}', f'UserPeer._get_relationships:{user.id}',
+                                             f'User.get_user_from_peer:{peer_id}').tag(f'User:{user.id}')
                             await user_db.delete()
+                            await UserPeer.reindex_user(user_id=user.id)
                             self._logger.info('User deactivated | %s | user deleted', user.id)
                         elif user.username != user_db.username:
-                            keys.extend((
-                                f'User.get_user_data:{user.id}',
-                                f'User.get_user_from_peer:{peer_id}'
-                            ))
+                            invalidation.add(f'User.get_user_from_peer:{peer_id}').tag(f'User:{user.id}')
                             self._logger.info('Update username | %s → %s', user_db.username, user.username)
                             await user_db.update(username=user.username).apply()
                         else:
                             self._logger.info('User has not changed | %s [%s]', user.id, user.username)
-                        [await Cache().delete(key=key) for key in keys]
-                offset += 100
-                query = db.select([User, Peer]).select_from(
-                    User.outerjoin(Peer)).limit(100).offset(offset).order_by(User.id)
-                result = await query.gino.load((User, Peer.id)).all()
+                await invalidation.flush()
         self._logger.info('Completed usernames updater')
 
+    async def _peer_refresher(self, user_id: int):
+        from models.peer import Peer as PeerModel
+
+        user_data = await User.get_user_data(user_id=user_id)
+        if not user_data:
+            return
+        _, peer_db, _ = user_data
+        if await Cache().get(key=f'Peer.refreshed:{peer_db.id}'):
+            return
+        try:
+            peer = await PeerModel().get_peer(login=peer_db.login, extended=False)
+        except (NotFoundIntraError, UnknownIntraError, TimeoutIntraError) as e:
+            self._logger.error('Refresh peer error | %s | %s', peer_db.login, e)
+            return
+        if peer.campus_id != peer_db.campus_id or peer.cursus_id != peer_db.cursus_id:
+            self._logger.info('Update peer | %s | campus=%s | cursus=%s', peer.login, peer.campus_id, peer.cursus_id)
+        await Cache().set(key=f'Peer.refreshed:{peer.id}', value=True, ttl=self._config.peer_staleness)
+
+    async def refresher(self):
+        lane.set(Lane.maintenance)
+        while True:
+            queue = self._config.refresh_queue.copy()
+            self._config.refresh_queue = set()
+            if queue:
+                self._logger.info('Start peers refresher | users=%s', len(queue))
+            for user_id in queue:
+                try:
+                    await self._peer_refresher(user_id=user_id)
+                except Exception as e:
+                    self._logger.error('Unknown peer refresher error | %s | %s', user_id, e)
+            await asyncio.sleep(10)
+
+    async def _relationships_indexer(self):
+        if await UserPeer.is_indexed() or not await Cache().lock(key=UserPeer.indexed_key, ttl=3600):
+            return
+        try:
+            self._logger.info('Start relationships indexer')
+            users = await UserPeer.build_index()
+            self._logger.info('Completed relationships indexer | users=%s', users)
+        finally:
+            await Cache().unlock(key=UserPeer.indexed_key)
+
+    async def index_relationships(self):
+        lane.set(Lane.maintenance)
+        while True:
+            try:
+                await self._relationships_indexer()
+            except Exception as e:
+                self._logger.error('Relationships indexer error | %s', e)
+            await asyncio.sleep(600)
+
     async def clear_queue(self):
         from bot import dp
         from config import Config
@@ -98,6 +145,7 @@ class Updater:
             await asyncio.sleep(120)
 
     async def updater(self):
+        lane.set(Lane.maintenance)
         while True:
             self._logger.info('Start updater')
             await self._campuses_updater()
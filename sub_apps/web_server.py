@@ -26,6 +26,7 @@ from services.states import States
 from misc import (dp,
                   bot)
 from utils.cache import (Cache,
+                         Invalidation,
                          del_cache)
 from utils.intra_api import (TimeoutIntraError,
                              UnknownIntraError)
@@ -69,13 +70,15 @@ class WebServer:
                 await UserPeer.update.values(
                     user_id=new_user_id).where(UserPeer.user_id == user_from_peer.id).gino.status()
             await Cache().delete(key=f'UserPeer._get_relationships:{user_from_peer.id}')
+            await UserPeer.reindex_user(user_id=user_from_peer.id)
+            await UserPeer.reindex_user(user_id=new_user_id)
             self._logger.info('Successful transfer relationships | %s', new_user_id)
 
     async def _create_user(self, new_user_id: int, language_code: str, peer_id: int,
                            user_from_peer: User) -> Tuple[User, str]:
-        keys = [f'User.get_user_from_peer:{peer_id}', f'User.get_user_data:{new_user_id}']
+        invalidation = Invalidation().add(f'User.get_user_from_peer:{peer_id}').tag(f'User:{new_user_id}')
         if user_from_peer:
-            keys.append(f'User.get_user_data:{user_from_peer.id}')
+            invalidation.tag(f'User:{user_from_peer.id}')
         user = await bot.get_chat(chat_id=new_user_id)
         user_from_id = await User.get(new_user_id)
         show_avatar = user_from_peer.show_avatar if user_from_peer else False
@@ -92,7 +95,7 @@ class WebServer:
                                       language=language_code, use_default_campus=use_default_campus).apply()
             new_user = await User.get(new_user_id)
             self._logger.info('Successful update user | %s', user.username or new_user_id)
-        [await Cache().delete(key=key) for key in keys]
+        await invalidation.flush()
         return new_user, language_code
 
     async def _authorization_process(self, code: str, state: str) -> bool:
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import time
+from contextlib import suppress
+from datetime import timedelta
+from typing import (Any,
+                    Dict,
+                    Optional,
+                    Set)
+
+from aiogram.types import (Chat,
+                           InlineKeyboardButton,
+                           InlineKeyboardMarkup,
+                           Message)
+from aiogram.utils.exceptions import (MessageNotModified,
+                                      MessageToEditNotFound)
+
+from db_models import db
+from db_models.keyset import keyset_iterate
+from db_models.peers import Peer
+from db_models.users import User
+from misc import bot
+from utils.helpers import AdminProcesses
+
+
+class Broadcast:
+    job_key = 'Broadcast:job'
+    status_key = 'Broadcast:status'
+    batch_key = 'Broadcast:batch'
+    _task: Optional[asyncio.Task] = None
+    statuses = {
+        'running': 'идёт',
+        'paused': 'на паузе',
+        'cancelled': 'отменена',
+        'completed': 'завершена',
+        'failed': 'прервана из-за ошибки'
+    }
+
+    def __init__(self):
+        from config import Config
+        self._config = Config
+        self._logger = logging.getLogger('Broadcast')
+        self._mailing = AdminProcesses(logger=self._logger).mailing
+
+    async def get_job(self) -> Optional[Dict[str, Any]]:
+        return await self._config.redis.get(key=self.job_key)
+
+    async def get_status(self) -> Optional[str]:
+        return await self._config.redis.get(key=self.status_key)
+
+    async def is_active(self) -> bool:
+        return await self.get_status() in ('running', 'paused')
+
+    @staticmethod
+    def _keyboard(status: str) -> Optional[InlineKeyboardMarkup]:
+        if status not in ('running', 'paused'):
+            return None
+        keyboard = InlineKeyboardMarkup(row_width=2)
+        if status == 'running':
+            keyboard.insert(InlineKeyboardButton('Пауза', callback_data='broadcast.pause'))
+        else:
+            keyboard.insert(InlineKeyboardButton('Продолжить', callback_data='broadcast.resume'))
+        keyboard.insert(InlineKeyboardButton('Отменить', callback_data='broadcast.cancel'))
+        return keyboard
+
+    def _text(self, job: Dict[str, Any], status: str) -> str:
+        rate = job['processed'] / job['elapsed'] if job['elapsed'] else 0
+        eta = timedelta(seconds=int((job['total'] - job['processed']) / rate)) if rate else '—'
+        return f'Рассылка {self.statuses.get(status, status)}\n' \
+               f'Обработано: {job["processed"]} из {job["total"]}\n' \
+               f'Ошибок: {job.get("failed", 0)}\n' \
+               f'Скорость: {rate:.1f} сообщ./сек\n' \
+               f'Осталось: {eta}'
+
+    async def report(self, new_message: bool = False):
+        job = await self.get_job()
+        if not job:
+            return
+        status = await self.get_status()
+        text = self._text(job=job, status=status)
+        keyboard = self._keyboard(status=status)
+        if not new_message:
+            with suppress(MessageNotModified):
+                try:
+                    await bot.edit_message_text(text, chat_id=self._config.admin,
+                                                message_id=job['status_message_id'], reply_markup=keyboard)
+                    return
+                except MessageToEditNotFound:
+                    pass
+        message = await bot.send_message(self._config.admin, text, reply_markup=keyboard)
+        job['status_message_id'] = message.message_id
+        await self._config.redis.set(key=self.job_key, value=job)
+
+    async def _send(self, message: Message, user: User, peer_id: int) -> bool:
+        try:
+            await self._mailing(message=message, user=user, peer_id=peer_id)
+            return True
+        except Exception as e:
+            self._logger.error('Failed broadcast sending | %s | %s', user.id, e, exc_info=True)
+            return False
+        finally:
+            await self._config.redis.raw('sadd', self.batch_key, user.id)
+
+    async def _run(self):
+        try:
+            await self._process()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._logger.error('Broadcast error | %s | status failed', e, exc_info=True)
+            await self._config.redis.set(key=self.status_key, value='failed')
+            with suppress(Exception):
+                await self.report()
+            with suppress(Exception):
+                await bot.send_message(self._config.admin, f'Рассылка прервана из-за ошибки: {e}')
+
+    async def _process(self):
+        job = await self.get_job()
+        message = Message(message_id=job['message_id'], chat=Chat(id=job['from_chat_id'], type='private'))
+        sent: Set[int] = {int(user_id) for user_id in await self._config.redis.raw('smembers', self.batch_key)}
+        start = (job['cursor'],) if job['cursor'] else None
+        reported_at = time.monotonic()
+        self._logger.info('Start broadcast from cursor=%s', job['cursor'])
+        query = db.select([User, Peer]).select_from(User.outerjoin(Peer))
+        async for result in keyset_iterate(query=query, columns=(User.id,), key=lambda row: (row[0].id,),
+                                           loader=(User, Peer.id), start=start):
+            status = await self.get_status()
+            if status != 'running':
+                self._logger.info('Stop broadcast | %s | cursor=%s', status, job['cursor'])
+                await self.report()
+                return
+            started_at = time.monotonic()
+            results = await asyncio.gather(*[self._send(message=message, user=user, peer_id=peer_id)
+                                             for user, peer_id in result if user.id not in sent])
+            sent = set()
+            job = await self.get_job()
+            job['cursor'] = result[-1][0].id
+            job['processed'] += len(result)
+            job['failed'] = job.get('failed', 0) + results.count(False)
+            job['elapsed'] += time.monotonic() - started_at
+            await self._config.redis.set(key=self.job_key, value=job)
+            await self._config.redis.delete(key=self.batch_key)
+            self._logger.info('Broadcast batch completed | cursor=%s | processed=%s', job['cursor'], job['processed'])
+            if time.monotonic() - reported_at > 30:
+                await self.report()
+                reported_at = time.monotonic()
+        await self._config.redis.set(key=self.status_key, value='completed')
+        self._logger.info('Completed broadcast')
+        await self.report()
+
+    def _start(self):
+        if Broadcast._task and not Broadcast._task.done():
+            return
+        Broadcast._task = asyncio.create_task(self._run())
+        self._config.sub_apps.running.append(Broadcast._task)
+
+    async def create(self, message: Message):
+        total = await db.select([db.func.count(User.id)]).gino.scalar()
+        job = {
+            'from_chat_id': message.chat.id,
+            'message_id': message.message_id,
+            'cursor': None,
+            'processed': 0,
+            'failed': 0,
+            'total': total,
+            'elapsed': 0,
+            'status_message_id': None
+        }
+        await self._config.redis.set(key=self.job_key, value=job)
+        await self._config.redis.set(key=self.status_key, value='running')
+        await self._config.redis.delete(key=self.batch_key)
+        await self.report(new_message=True)
+        self._start()
+
+    async def set_status(self, status: str):
+        current = await self.get_status()
+        if current not in ('running', 'paused'):
+            return
+        await self._config.redis.set(key=self.status_key, value=status)
+        self._logger.info('Broadcast status | %s → %s', current, status)
+        if status == 'running' and current == 'paused':
+            self._start()
+        else:
+            await self.report()
+
+    async def resume(self):
+        if await self.get_status() == 'running':
+            self._logger.info('Resume broadcast after restart')
+            self._start()
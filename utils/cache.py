@@ -1,11 +1,147 @@
+import asyncio
+import logging
+import random
+import time
+import zlib
+from collections import OrderedDict
+from contextvars import ContextVar
+from decimal import Decimal
 from typing import (Any,
+                    Awaitable,
                     Callable,
                     Dict,
+                    Iterable,
                     List,
+                    Optional,
+                    Set,
+                    Tuple,
                     Union)
 
+import aioredis
+import msgpack
+from aiocache.serializers import BaseSerializer
+
+from utils.rate_limiter import lane
+
+INVALIDATE_SCRIPT = '''
+local keys = {}
+for i = 1, tonumber(ARGV[1]) do
+    keys[#keys + 1] = KEYS[i]
+end
+for i = tonumber(ARGV[1]) + 1, #KEYS do
+    for _, member in ipairs(redis.call('SMEMBERS', KEYS[i])) do
+        keys[#keys + 1] = member
+    end
+    keys[#keys + 1] = KEYS[i]
+end
+for i = 1, #keys, 1000 do
+    redis.call('UNLINK', unpack(keys, i, math.min(i + 999, #keys)))
+end
+return keys
+'''
+
+SET_SCRIPT = '''
+local ttl = tonumber(ARGV[2])
+if ttl > 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ttl)
+else
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+for i = 2, #KEYS do
+    local current = redis.call('TTL', KEYS[i])
+    redis.call('SADD', KEYS[i], KEYS[1])
+    if ttl == 0 then
+        redis.call('PERSIST', KEYS[i])
+    elseif current == -2 or (current >= 0 and current < ttl) then
+        redis.call('EXPIRE', KEYS[i], ttl)
+    end
+end
+redis.call('PUBLISH', ARGV[3], KEYS[1])
+return 1
+'''
+
+GET_SCRIPT = '''
+return {redis.call('GET', KEYS[1]), redis.call('PTTL', KEYS[1])}
+'''
+
+BUMP_SCRIPT = '''
+for i = 1, #KEYS do
+    redis.call('INCR', KEYS[i])
+end
+return 1
+'''
+
+
+class CompressedMsgPackSerializer(BaseSerializer):
+    DEFAULT_ENCODING = None
+
+    def __init__(self, *args, compress_threshold: int = 1024, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._compress_threshold = compress_threshold
+
+    @staticmethod
+    def _default(value: Any) -> Any:
+        if isinstance(value, Decimal):
+            return float(value)
+        raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+    def dumps(self, value: Any) -> bytes:
+        data = msgpack.packb(value, use_bin_type=True, default=self._default)
+        if len(data) > self._compress_threshold:
+            return b'z' + zlib.compress(data)
+        return b'm' + data
+
+    def loads(self, value: Optional[bytes]) -> Any:
+        if not value:
+            return None
+        try:
+            if value[:1] == b'z':
+                return msgpack.unpackb(zlib.decompress(value[1:]), raw=False, strict_map_key=False)
+            if value[:1] == b'm':
+                return msgpack.unpackb(value[1:], raw=False, strict_map_key=False)
+        except (ValueError, zlib.error, msgpack.UnpackException):
+            pass
+        return None
+
+
+request_memo: ContextVar[Optional[Dict[str, Any]]] = ContextVar('request_memo', default=None)
+
+
+class LocalCache:
+    def __init__(self, maxsize: int = 4096, ttl: int = 30):
+        self._data: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self._maxsize = maxsize
+        self._ttl = ttl
+
+    def get(self, key: str) -> Any:
+        record = self._data.get(key)
+        if record is None:
+            return None
+        expires_at, value = record
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        ttl = min(ttl, self._ttl) if ttl else self._ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
 
 class Cache:
+    local = LocalCache()
+    channel = 'Cache:invalidate'
+
     def __init__(self):
         from config import Config
 
@@ -18,6 +154,12 @@ class Cache:
             key += f':{".".join([str(value) for value in kwargs.values()])}'
         return key
 
+    @staticmethod
+    def get_schema_key(func: Callable, key_fields: Tuple[str, ...], version: int, namespace_version: int,
+                       kwargs: Dict[str, Any]) -> str:
+        values = '.'.join([str(kwargs[field]) for field in key_fields])
+        return f'{func.__qualname__}:v{version}.{namespace_version}:{values}'
+
     @staticmethod
     def serialization(value: Any) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
         if isinstance(value, (list, tuple)):
@@ -37,14 +179,122 @@ class Cache:
         from db_models.users import User
         return [cls.from_dict(value) for cls, value in zip((Campus, Peer, User), values)]
 
-    async def set(self, key: str, value: Any, ttl: int = None):
-        await self._redis.set(key=key, value=value, ttl=ttl)
+    async def set(self, key: str, value: Any, ttl: int = None, tags: Iterable[str] = ()):
+        raw = self._redis.serializer.dumps(value)
+        await self._redis.raw('eval', SET_SCRIPT, keys=[key, *[f'Tag:{tag}' for tag in tags]],
+                              args=[raw, ttl or 0, self.channel])
+        if value is not None:
+            self.local.set(key=key, value=raw, ttl=ttl)
 
     async def get(self, key: str) -> Any:
-        return await self._redis.get(key=key)
+        raw = self.local.get(key=key)
+        if raw is None:
+            raw, pttl = await self._redis.raw('eval', GET_SCRIPT, keys=[key])
+            if raw is not None and pttl != 0:
+                self.local.set(key=key, value=raw, ttl=pttl / 1000 if pttl > 0 else None)
+        return self._redis.serializer.loads(raw)
 
     async def delete(self, key: str):
-        await self._redis.delete(key=key)
+        await self.delete_many(keys=[key])
+
+    async def delete_many(self, keys: Iterable[str] = (), tags: Iterable[str] = ()):
+        keys = list(dict.fromkeys(keys))
+        tag_keys = [f'Tag:{tag}' for tag in dict.fromkeys(tags)]
+        if not keys and not tag_keys:
+            return
+        deleted = await self._redis.raw('eval', INVALIDATE_SCRIPT, keys=keys + tag_keys, args=[len(keys)])
+        deleted = [key.decode('utf-8') if isinstance(key, bytes) else key for key in deleted]
+        memo = request_memo.get()
+        for key in deleted:
+            self.local.delete(key=key)
+            if memo:
+                memo.pop(key, None)
+        await self._redis.raw('publish', self.channel, '\n'.join(deleted))
+
+    async def get_version(self, namespace: str) -> int:
+        key = f'Namespace:{namespace}'
+        version = self.local.get(key=key)
+        if version is None:
+            version = int(await self._redis.raw('get', key) or 0)
+            self.local.set(key=key, value=version)
+        return version
+
+    async def bump(self, *namespaces: str):
+        keys = [f'Namespace:{namespace}' for namespace in namespaces]
+        if not keys:
+            return
+        await self._redis.raw('eval', BUMP_SCRIPT, keys=keys)
+        for key in keys:
+            self.local.delete(key=key)
+        await self._redis.raw('publish', self.channel, '\n'.join(keys))
+
+    async def lock(self, key: str, ttl: int) -> bool:
+        try:
+            await self._redis.add(key=f'Lock:{key}', value=True, ttl=ttl)
+            return True
+        except ValueError:
+            return False
+
+    async def unlock(self, key: str):
+        await self._redis.delete(key=f'Lock:{key}')
+
+
+async def listen_invalidations(redis_url: str):
+    logger = logging.getLogger('Cache')
+    while True:
+        try:
+            connection = await aioredis.create_redis(redis_url)
+            try:
+                channel, = await connection.subscribe(Cache.channel)
+                logger.info('Subscribed to %s', Cache.channel)
+                async for message in channel.iter(encoding='utf-8'):
+                    for key in message.split('\n'):
+                        Cache.local.delete(key=key)
+            finally:
+                connection.close()
+                await connection.wait_closed()
+        except (ConnectionError, aioredis.RedisError) as e:
+            logger.error('Invalidation listener error | %s | clear local cache, reconnect', e)
+        Cache.local.clear()
+        await asyncio.sleep(1)
+
+
+class Invalidation:
+    def __init__(self):
+        self.keys: Set[str] = set()
+        self.tags: Set[str] = set()
+
+    def add(self, *keys: str) -> 'Invalidation':
+        self.keys.update(keys)
+        return self
+
+    def tag(self, *tags: str) -> 'Invalidation':
+        self.tags.update(tags)
+        return self
+
+    async def flush(self):
+        keys, tags = self.keys, self.tags
+        self.keys, self.tags = set(), set()
+        await Cache().delete_many(keys=keys, tags=tags)
+
+    async def __aenter__(self) -> 'Invalidation':
+        return self
+
+    async def __aexit__(self, *args):
+        await self.flush()
+
+
+_in_flight: Dict[str, asyncio.Future] = {}
+
+
+async def single_flight(key: str, coroutine: Callable[[], Awaitable[Any]]) -> Any:
+    key = f'{key}|{lane.get().name}'
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(coroutine())
+        _in_flight[key] = task
+        task.add_done_callback(lambda done: _in_flight.pop(key) if _in_flight.get(key) is done else None)
+    return await asyncio.shield(task)
 
 
 def del_cache(keys: List[str], without_sub_key: List[int] = None):
@@ -52,32 +302,96 @@ def del_cache(keys: List[str], without_sub_key: List[int] = None):
         async def wrapper(*args, **kwargs) -> Any:
             cls = args[0]
             sub_key = tuple(kwargs.values())[0]
+            invalidation = Invalidation()
             for i, key in enumerate(keys):
                 if i not in (without_sub_key or []):
                     key = f'{key}:{sub_key}'
-                await Cache().delete(key=key)
+                invalidation.add(key)
+            await invalidation.flush()
             return await func(cls, **kwargs)
         return wrapper
     return decorator
 
 
-def cache(ttl: int = None, serialization: bool = False, deserialization: bool = False, is_user_data: bool = False):
+def cache(ttl: int = None, serialization: bool = False, deserialization: bool = False, is_user_data: bool = False,
+          lock: bool = False, lock_ttl: int = 30, stale_ttl: int = None, jitter: float = 0.1,
+          tags: Callable[..., Iterable[str]] = None, key_fields: Tuple[str, ...] = None, namespace: str = None,
+          version: int = 1, memoize: bool = False):
     def decorator(func: Callable) -> Callable:
-        async def wrapper(*args, **kwargs) -> Any:
-            cls = args[0]
-            key = Cache.get_key(func=func, **kwargs)
-            value = await Cache().get(key=key)
-            if value is None:
-                value = await func(cls, **kwargs)
-                save_data = value
-                if serialization:
-                    save_data = Cache.serialization(value=value)
-                await Cache().set(key=key, value=save_data, ttl=ttl)
-                return value
+        async def get_key(kwargs: Dict[str, Any]) -> str:
+            if not key_fields:
+                return Cache.get_key(func=func, **kwargs)
+            namespace_version = await Cache().get_version(namespace=namespace.format(**kwargs)) if namespace else 0
+            return Cache.get_schema_key(func=func, key_fields=key_fields, version=version,
+                                        namespace_version=namespace_version, kwargs=kwargs)
+
+        def restore(cls, value: Any) -> Any:
             if deserialization:
                 return Cache.deserialization(cls=cls, value=value)
             if is_user_data:
                 return Cache.deserialization_user_data(values=value)
             return value
+
+        def unwrap(value: Any) -> Tuple[Any, bool]:
+            if isinstance(value, dict) and '__swr__' in value:
+                return value['value'], value['__swr__'] < time.time()
+            return value, False
+
+        async def load(cls, key: str, kwargs: Dict[str, Any]) -> Any:
+            value = await func(cls, **kwargs)
+            save_data = value
+            if serialization:
+                save_data = Cache.serialization(value=value)
+            soft_ttl = int(ttl * (1 + random.uniform(0, jitter))) if ttl else ttl
+            hard_ttl = soft_ttl
+            if soft_ttl and stale_ttl:
+                save_data = {'__swr__': time.time() + soft_ttl, 'value': save_data}
+                hard_ttl = soft_ttl + stale_ttl
+            await Cache().set(key=key, value=save_data, ttl=hard_ttl, tags=tags(value, **kwargs) if tags else ())
+            return value
+
+        async def locked_load(cls, key: str, kwargs: Dict[str, Any]) -> Any:
+            for _ in range(lock_ttl * 10):
+                if await Cache().lock(key=key, ttl=lock_ttl):
+                    try:
+                        value, _ = unwrap(await Cache().get(key=key))
+                        if value is not None:
+                            return restore(cls=cls, value=value)
+                        return await load(cls=cls, key=key, kwargs=kwargs)
+                    finally:
+                        await Cache().unlock(key=key)
+                await asyncio.sleep(0.1)
+                value, _ = unwrap(await Cache().get(key=key))
+                if value is not None:
+                    return restore(cls=cls, value=value)
+            return await load(cls=cls, key=key, kwargs=kwargs)
+
+        def revalidate(cls, key: str, kwargs: Dict[str, Any]):
+            def done_callback(task: asyncio.Future):
+                if not task.cancelled() and task.exception():
+                    logging.getLogger('Cache').error('Revalidate error | %s | %s', key, task.exception())
+
+            task = asyncio.ensure_future(single_flight(key=key, coroutine=lambda: load(cls=cls, key=key,
+                                                                                       kwargs=kwargs)))
+            task.add_done_callback(done_callback)
+
+        async def fetch(cls, key: str, kwargs: Dict[str, Any]) -> Any:
+            value, is_stale = unwrap(await Cache().get(key=key))
+            if value is None:
+                loader = locked_load if lock else load
+                return await single_flight(key=key, coroutine=lambda: loader(cls=cls, key=key, kwargs=kwargs))
+            if is_stale:
+                revalidate(cls=cls, key=key, kwargs=kwargs)
+            return restore(cls=cls, value=value)
+
+        async def wrapper(*args, **kwargs) -> Any:
+            cls = args[0]
+            key = await get_key(kwargs=kwargs)
+            memo = request_memo.get() if memoize else None
+            if memo is None:
+                return await fetch(cls=cls, key=key, kwargs=kwargs)
+            if key not in memo:
+                memo[key] = await fetch(cls=cls, key=key, kwargs=kwargs)
+            return memo[key]
         return wrapper
     return decorator
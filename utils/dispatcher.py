@@ -0,0 +1,95 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from enum import IntEnum
+from typing import (Any,
+                    Awaitable,
+                    Callable,
+                    Deque,
+                    Dict,
+                    List)
+
+from aiogram.utils.exceptions import RetryAfter
+
+
+class Priority(IntEnum):
+    notification = 0
+    bulk = 1
+
+
+class MessageDispatcher:
+    def __init__(self, workers: int = 16, rate_limit: int = 30, chat_interval: float = 1.0,
+                 bulk_share: float = 0.8):
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._counter = itertools.count()
+        self._workers_count = workers
+        self._workers: List[asyncio.Task] = []
+        self._rate_limit = rate_limit
+        self._bulk_limit = max(1, int(rate_limit * bulk_share))
+        self._chat_interval = chat_interval
+        self._sent: Deque[float] = deque()
+        self._chats_sent: Dict[int, float] = {}
+        self._paused_until = 0.0
+        self._logger = logging.getLogger('MessageDispatcher')
+
+    async def _wait_chat(self, chat_id: int):
+        now = time.monotonic()
+        if len(self._chats_sent) > 10000:
+            self._chats_sent = {chat: sent_at for chat, sent_at in self._chats_sent.items()
+                                if now - sent_at < self._chat_interval}
+        delay = self._chats_sent.get(chat_id, 0) + self._chat_interval - now
+        self._chats_sent[chat_id] = now + max(delay, 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _wait_global(self, priority: Priority):
+        limit = self._bulk_limit if priority is Priority.bulk else self._rate_limit
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            while self._sent and now - self._sent[0] >= 1:
+                self._sent.popleft()
+            if len(self._sent) < limit:
+                self._sent.append(now)
+                return
+            await asyncio.sleep(1 - (now - self._sent[0]))
+
+    async def _worker(self):
+        while True:
+            priority, _, chat_id, sender, future = await self._queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                await self._wait_chat(chat_id=chat_id)
+                await self._wait_global(priority=priority)
+                try:
+                    result = await sender()
+                except RetryAfter as e:
+                    self._logger.error('Flood control | %s | retry after %s seconds', chat_id, e.timeout)
+                    self._paused_until = max(self._paused_until, time.monotonic() + e.timeout)
+                    self._queue.put_nowait((priority, next(self._counter), chat_id, sender, future))
+                except Exception as e:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                else:
+                    if not future.cancelled():
+                        future.set_result(result)
+            finally:
+                self._queue.task_done()
+
+    async def send(self, chat_id: int, sender: Callable[[], Awaitable[Any]],
+                   priority: Priority = Priority.bulk) -> Any:
+        future = asyncio.get_event_loop().create_future()
+        self._queue.put_nowait((priority, next(self._counter), chat_id, sender, future))
+        return await future
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._workers_count)]
+
+    def stop(self):
+        for worker in self._workers:
+            worker.cancel()
@@ -1,4 +1,3 @@
-import asyncio
 import logging
 from io import BytesIO
 from typing import (Dict,
@@ -12,13 +11,13 @@ from aiogram.utils.exceptions import (BotBlocked,
 from aiogram.utils.markdown import hcode
 from bs4 import BeautifulSoup
 
-from db_models import db
-from db_models.peers import Peer
 from db_models.projects import Project
 from db_models.users import User
+from db_models.users_peers import UserPeer
 from services.keyboards import menu_keyboard
 from misc import bot
 from utils.cache import Cache
+from utils.dispatcher import Priority
 
 
 class AdminProcesses:
@@ -69,14 +68,18 @@ class AdminProcesses:
             self._logger.info('Delete projects from cursus | %s | %s ', cursus_id, data[cursus_id])
         return 'Готово!'
 
-    async def mailing(self, message: Union[str, Message], user: User, peer_id: int):
+    async def mailing(self, message: Union[str, Message], user: User, peer_id: int,
+                      priority: Priority = Priority.bulk):
         try:
             if isinstance(message, Message):
-                await message.copy_to(chat_id=user.id, reply_markup=menu_keyboard(user.language))
+                def sender():
+                    return bot.copy_message(chat_id=user.id, from_chat_id=message.chat.id,
+                                            message_id=message.message_id, reply_markup=menu_keyboard(user.language))
             else:
-                await bot.send_message(chat_id=user.id, text=message, disable_web_page_preview=True)
+                def sender():
+                    return bot.send_message(chat_id=user.id, text=message, disable_web_page_preview=True)
+            await self._config.dispatcher.send(chat_id=user.id, sender=sender, priority=priority)
             self._logger.info('Successful message sending | %s [%s] | completed', user.id, user.username)
-            await asyncio.sleep(0.5)
 
         except (BotBlocked, UserDeactivated) as e:
             self._logger.error('Failed message sending | %s [%s] | %s | user deleted',
@@ -84,26 +87,12 @@ class AdminProcesses:
             keys = [
                 f'Peer.get_peer:{peer_id}',
                 f'UserPeer._get_relationships:{user.id}',
-                f'User.get_user_data:{user.id}',
                 f'User.get_user_from_peer:{peer_id}'
             ]
             await user.delete()
-            [await Cache().delete(key=key) for key in keys]
+            await UserPeer.reindex_user(user_id=user.id)
+            await Cache().delete_many(keys=keys, tags=[f'User:{user.id}'])
 
         except ChatNotFound as e:
             self._logger.error('Failed message sending | %s [%s] | %s | pass',
                                user.id, user.username, e)
-
-    async def sending_messages(self, message: Message):
-        offset = 0
-        query = db.select([User, Peer]).select_from(User.outerjoin(Peer)).limit(100).offset(offset).order_by(User.id)
-        result = await query.gino.load((User, Peer.id)).all()
-        while result:
-            self._logger.info('Start mailing for offset=%s', offset)
-            for user, peer_id in result:
-                await self.mailing(message=message, user=user, peer_id=peer_id)
-            offset += 100
-            query = db.select([User, Peer]).select_from(
-                User.outerjoin(Peer)).limit(100).offset(offset).order_by(User.id)
-            result = await query.gino.load((User, Peer.id)).all()
-        self._logger.info('Completed mailing')
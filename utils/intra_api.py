@@ -1,17 +1,22 @@
 import asyncio
 import logging
+import math
 import ssl
-from collections import deque
+import time
 from contextlib import suppress
 from datetime import (datetime,
                       timedelta)
 from typing import (Any,
-                    Deque,
+                    AsyncIterator,
+                    Awaitable,
+                    Callable,
                     Dict,
                     List,
+                    Optional,
                     Tuple,
                     Union)
-from urllib.parse import urljoin
+from urllib.parse import (urlencode,
+                          urljoin)
 
 import certifi
 import ujson
@@ -19,11 +24,13 @@ from aiohttp import (ClientSession,
                      ClientTimeout,
                      TCPConnector)
 from aiohttp.client_exceptions import ContentTypeError
-from asyncio_throttle import Throttler
 from pytz import timezone
 
 from db_models.applications import Application
-from utils.cache import cache
+from utils.cache import (Cache,
+                         cache,
+                         single_flight)
+from utils.rate_limiter import RateLimiter
 
 
 class IntraAPIError(Exception):
@@ -42,9 +49,26 @@ class TimeoutIntraError(IntraAPIError):
     """"""
 
 
+PEER_FIELDS = {
+    'id': None, 'login': None, 'displayname': None, 'pool_month': None, 'pool_year': None, 'location': None,
+    'staff?': None, 'image_url': None,
+    'cursus_users': {'id': None, 'level': None, 'end_at': None, 'cursus': {'id': None, 'name': None}},
+    'campus_users': {'campus_id': None, 'is_primary': None},
+    'campus': {'id': None, 'name': None, 'time_zone': None},
+    'titles': {'id': None, 'name': None},
+    'titles_users': {'title_id': None, 'selected': None},
+    'projects_users': {'id': None, 'final_mark': None, 'status': None, 'validated?': None, 'cursus_ids': None,
+                       'project': {'id': None, 'name': None, 'parent_id': None}}
+}
+PEERS_FIELDS = {'id': None, 'login': None}
+COALITION_USER_FIELDS = {'user_id': None, 'coalition_id': None}
+LOCATION_FIELDS = {'id': None, 'host': None, 'campus_id': None, 'begin_at': None, 'end_at': None,
+                   'user': {'id': None, 'login': None}}
+
+
 class IntraAPI:
     def __init__(self, config):
-        self._apps: Deque[Dict[str, Any]] = deque()
+        self._apps: Dict[int, Dict[str, Any]] = {}
         self._base_url = 'https://api.intra.42.fr/v2/'
         self._auth_url = 'https://api.intra.42.fr/oauth/token'
         self._config = config
@@ -55,94 +79,204 @@ class IntraAPI:
         connector = TCPConnector(ssl=ssl_context)
         timeout: ClientTimeout = ClientTimeout(total=60)
         self.session: ClientSession = ClientSession(connector=connector, json_serialize=ujson.dumps, timeout=timeout)
-        self._throttler = Throttler(rate_limit=20)
+        self._limiter = RateLimiter(redis=config.redis)
 
-    async def _request_token(self, params: Dict[str, str]) -> str:
+    async def _request_token(self, params: Dict[str, str]) -> Optional[Dict[str, Any]]:
         with suppress(asyncio.exceptions.TimeoutError):
             async with self.session.request('POST', self._auth_url, params=params) as response:
                 if response.status == 200:
-                    js = await response.json()
-                    return js['access_token']
+                    return await response.json()
 
-    async def _get_token(self, application_id: int, client_id: str, client_secret: str) -> str:
+    async def _get_token(self, app: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         params = {
             'grant_type': 'client_credentials',
-            'client_id': client_id,
-            'client_secret': client_secret
+            'client_id': app['client_id'],
+            'client_secret': app['client_secret']
         }
-        access_token = await self._request_token(params=params)
-        self._logger.info('Get token=%s from application=%s', access_token, application_id)
-        return access_token
-
-    async def _request(self, endpoint: str, params: dict = None,
-                       personal_access_token: str = None) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+        token = await self._request_token(params=params)
+        if token:
+            token = {'access_token': token['access_token'], 'expires_at': time.time() + token['expires_in']}
+            await self._config.redis.set(key=f'IntraAPI.token:{app["id"]}', value=token,
+                                         ttl=int(token['expires_at'] - time.time()))
+        self._logger.info('Get token=%s from application=%s', token and token['access_token'], app['id'])
+        return token
+
+    async def _load_token(self, app: Dict[str, Any], min_ttl: int = 60, expired: str = None):
+        key = f'IntraAPI.token:{app["id"]}'
+        for _ in range(300):
+            token = await self._config.redis.get(key=key)
+            if token and token['access_token'] != expired and token['expires_at'] - time.time() > min_ttl:
+                break
+            if await Cache().lock(key=key, ttl=30):
+                try:
+                    token = await self._get_token(app=app)
+                finally:
+                    await Cache().unlock(key=key)
+                break
+            await asyncio.sleep(0.1)
+        else:
+            token = None
+        if token:
+            app['access_token'] = token['access_token']
+            app['expires_at'] = token['expires_at']
+
+    async def _refresh_tokens(self, interval: int = 60, min_ttl: int = 600):
+        while True:
+            await asyncio.sleep(interval)
+            results = await asyncio.gather(*[self._load_token(app=app, min_ttl=min_ttl) for app in self._apps.values()],
+                                           return_exceptions=True)
+            for app_id, result in zip(self._apps, results):
+                if isinstance(result, Exception):
+                    self._logger.error('Refresh token error | application=%s | %s', app_id, result)
+
+    async def _request(self, endpoint: str, params: dict = None, personal_access_token: str = None,
+                       with_headers: bool = False) -> Union[Dict[str, Any], List[Dict[str, Any]], Tuple[Any, Dict]]:
+        if personal_access_token:
+            return await self._fetch(endpoint=endpoint, params=params, personal_access_token=personal_access_token,
+                                     with_headers=with_headers)
+        key = f'IntraAPI:{endpoint}?{urlencode(sorted((params or {}).items()))}:{with_headers}'
+        return await single_flight(key=key, coroutine=lambda: self._fetch(endpoint=endpoint, params=params,
+                                                                          with_headers=with_headers))
+
+    async def _fetch(self, endpoint: str, params: dict = None, personal_access_token: str = None,
+                     with_headers: bool = False) -> Union[Dict[str, Any], List[Dict[str, Any]], Tuple[Any, Dict]]:
         url = urljoin(self._base_url, endpoint)
         params = params or {}
-        self._apps.rotate(int(not personal_access_token))
-        async with self._throttler:
-            attempts = 1
-            while attempts < 10:
-                app = self._apps[0]
-                access_token = personal_access_token or app['access_token']
-                params = {**params, 'access_token': str(access_token)}
-                try:
-                    async with self.session.request('GET', url, params=params) as response:
-                        if access_token is None and endpoint != 'me':
-                            self._apps[0]['access_token'] = await self._get_token(application_id=app['id'],
-                                                                                  client_id=app['client_id'],
-                                                                                  client_secret=app['client_secret'])
-                        if response.status == 200:
-
-                            try:
-                                json_response = await response.json()
-                                self._logger.info('Request=%s %s [%s] | %s | %s | completed',
-                                                  attempts, response.reason, response.status, url, access_token)
-                                return json_response
-                            except ContentTypeError as e:
-                                self._logger.error('Request=%s %s [%s] | %s | %s | ContentTypeError %s | continue',
-                                                   attempts, response.reason, response.status, url, access_token, e)
-                                continue
-
-                        if response.status == 429 and endpoint == 'me':
-                            self._logger.error('Request=%s %s [%s] | %s | %s | continue',
-                                               attempts, response.reason, response.status, url, access_token)
+        attempts = 1
+        while attempts < 10:
+            app = None
+            access_token = personal_access_token
+            if not personal_access_token:
+                app = self._apps[await self._limiter.acquire()]
+                access_token = app['access_token']
+            params = {**params, 'access_token': str(access_token)}
+            try:
+                async with self.session.request('GET', url, params=params) as response:
+                    if app:
+                        await self._limiter.update(application_id=app['id'], headers=response.headers)
+                        if access_token is None:
+                            await self._load_token(app=app)
+                    if response.status == 200:
+
+                        try:
+                            json_response = await response.json()
+                            self._logger.info('Request=%s %s [%s] | %s | %s | completed',
+                                              attempts, response.reason, response.status, url, access_token)
+                            if with_headers:
+                                return json_response, dict(response.headers)
+                            return json_response
+                        except ContentTypeError as e:
+                            self._logger.error('Request=%s %s [%s] | %s | %s | ContentTypeError %s | continue',
+                                               attempts, response.reason, response.status, url, access_token, e)
                             continue
 
-                        if response.status == 401 and (await response.json()).get(
-                                'message') == 'The access token expired':
-                            self._logger.error('Request=%s %s [%s] | %s | %s | token expired | refresh, reset attempts',
-                                               attempts, response.reason, response.status, url, access_token)
-                            self._apps[0]['access_token'] = await self._get_token(application_id=app['id'],
-                                                                                  client_id=app['client_id'],
-                                                                                  client_secret=app['client_secret'])
-                            attempts = 1
-
-                        if response.status == 404:
-                            self._logger.error('Request=%s %s [%s] | %s | %s | raise NotFoundIntraError',
-                                               attempts, response.reason, response.status, url, access_token)
-                            raise NotFoundIntraError(f'Intra response: {response.reason} [{response.status}]')
-
-                        self._logger.error('Request=%s %s [%s] | %s | %s | continue',
+                    if response.status == 429:
+                        retry_after = float(response.headers.get('Retry-After') or 1)
+                        self._logger.error('Request=%s %s [%s] | %s | %s | wait %s seconds | continue',
+                                           attempts, response.reason, response.status, url, access_token,
+                                           retry_after)
+                        if app:
+                            await self._limiter.block(application_id=app['id'], seconds=retry_after)
+                        else:
+                            await asyncio.sleep(retry_after)
+                        continue
+
+                    if response.status == 401 and app and (await response.json()).get(
+                            'message') == 'The access token expired':
+                        self._logger.error('Request=%s %s [%s] | %s | %s | token expired | refresh',
                                            attempts, response.reason, response.status, url, access_token)
-                        attempts += 1
-                        self._apps.rotate(1)
-
-                except asyncio.exceptions.TimeoutError:
-                    self._logger.error('Request=%s | %s | raise TimeoutIntraError', attempts, url)
-                    raise TimeoutIntraError(f'Intra does not respond for more than 60 seconds')
+                        await self._load_token(app=app, expired=access_token)
 
-            self._logger.error('Request=%s %s [%s] | %s | %s | raise UnknownIntraError',
-                               attempts, response.reason, response.status, url, access_token)
-            raise UnknownIntraError(f'Intra response: {response.reason} [{response.status}]')
+                    if response.status == 404:
+                        self._logger.error('Request=%s %s [%s] | %s | %s | raise NotFoundIntraError',
+                                           attempts, response.reason, response.status, url, access_token)
+                        raise NotFoundIntraError(f'Intra response: {response.reason} [{response.status}]')
+
+                    self._logger.error('Request=%s %s [%s] | %s | %s | continue',
+                                       attempts, response.reason, response.status, url, access_token)
+                    attempts += 1
+
+            except asyncio.exceptions.TimeoutError:
+                self._logger.error('Request=%s | %s | raise TimeoutIntraError', attempts, url)
+                raise TimeoutIntraError(f'Intra does not respond for more than 60 seconds')
+
+        self._logger.error('Request=%s %s [%s] | %s | %s | raise UnknownIntraError',
+                           attempts, response.reason, response.status, url, access_token)
+        raise UnknownIntraError(f'Intra response: {response.reason} [{response.status}]')
+
+    @staticmethod
+    def _prune(data: Any, fields: Dict[str, Any]) -> Any:
+        if isinstance(data, list):
+            return [IntraAPI._prune(data=item, fields=fields) for item in data]
+        if not isinstance(data, dict):
+            return data
+        return {key: IntraAPI._prune(data=data[key], fields=sub_fields) if sub_fields else data[key]
+                for key, sub_fields in fields.items() if key in data}
+
+    async def _iter_pages(self, endpoint: str, params: Dict[str, Any],
+                          max_pages: int = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        params = {**params, 'page': 1}
+        data, headers = await self._request(endpoint, params=params, with_headers=True)
+        yield data
+        if headers.get('X-Total') is None:
+            page = 1
+            while data and (not max_pages or page < max_pages):
+                page += 1
+                data = await self._request(endpoint, params={**params, 'page': page})
+                if data:
+                    yield data
+            return
+        per_page = int(headers.get('X-Per-Page') or params.get('per_page') or 30)
+        pages = math.ceil(int(headers['X-Total']) / per_page)
+        if max_pages:
+            pages = min(pages, max_pages)
+        tasks = [asyncio.ensure_future(self._request(endpoint, params={**params, 'page': page}))
+                 for page in range(2, pages + 1)]
+        try:
+            for task in tasks:
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+                task.add_done_callback(self._consume_exception)
+
+    @staticmethod
+    def _consume_exception(task: asyncio.Future):
+        if not task.cancelled():
+            task.exception()
+
+    async def _get_pages(self, endpoint: str, params: Dict[str, Any], max_pages: int = None) -> List[Dict[str, Any]]:
+        return [record async for page in self._iter_pages(endpoint, params=params, max_pages=max_pages)
+                for record in page]
+
+    async def is_not_found(self, login: str) -> bool:
+        return bool(await Cache().get(key=f'NotFound.login:{login}'))
+
+    async def set_not_found(self, login: str):
+        await Cache().set(key=f'NotFound.login:{login}', value=True, ttl=self._config.not_found_ttl)
+
+    async def _not_found_guard(self, login: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        if await self.is_not_found(login=login):
+            raise NotFoundIntraError('Intra response: Not Found [404]')
+        try:
+            return await loader()
+        except NotFoundIntraError:
+            await self.set_not_found(login=login)
+            raise
 
     async def load(self):
         applications = await Application.get_all() if not self._config.test else [await Application.get_test()]
-        self._apps = deque(maxlen=len(applications))
-        for application in applications:
-            access_token = await self._get_token(application_id=application.id,
-                                                 client_id=application.client_id,
-                                                 client_secret=application.client_secret)
-            self._apps.append({**application.to_dict(), 'access_token': access_token})
+        self._apps = {application.id: {**application.to_dict(), 'access_token': None, 'expires_at': 0}
+                      for application in applications}
+        await asyncio.gather(*[self._load_token(app=app) for app in self._apps.values()])
+        self._limiter.load(application_ids=self._apps)
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_tokens())
+
+    async def close(self):
+        if self._refresher:
+            self._refresher.cancel()
+        await self.session.close()
 
     async def auth(self, client_id: str, client_secret: str, code: str) -> str:
         params = {
@@ -152,51 +286,69 @@ class IntraAPI:
             'code': code,
             'redirect_uri': self._config.bot_base_url
         }
-        return await self._request_token(params=params)
+        token = await self._request_token(params=params)
+        if token:
+            return token['access_token']
 
     async def get_me(self, personal_access_token: str) -> Dict[str, Any]:
         endpoint = 'me'
         return await self._request(endpoint, personal_access_token=personal_access_token)
 
-    @cache(ttl=120)
+    @cache(ttl=120, lock=True)
     async def get_peer(self, login: str) -> Dict[str, Any]:
         endpoint = f'users/{login}'
-        return await self._request(endpoint)
+        peer = await self._not_found_guard(login=login, loader=lambda: self._request(endpoint))
+        return self._prune(data=peer, fields=PEER_FIELDS)
 
-    @cache(ttl=3600)
+    @cache(ttl=3600, stale_ttl=86400)
     async def get_peers(self, logins: List[str]) -> List[Dict[str, Any]]:
         endpoint = f'users'
-        return await self._request(endpoint, params={'filter[login]': ','.join(logins)})
+        peers = await self._request(endpoint, params={'filter[login]': ','.join(logins)})
+        return self._prune(data=peers, fields=PEERS_FIELDS)
 
-    @cache(ttl=3600)
+    @cache(ttl=3600, stale_ttl=86400)
     async def get_peer_coalitions(self, login: str) -> List[Dict[str, Any]]:
         endpoint = f'users/{login}/coalitions_users'
-        return await self._request(endpoint)
+        coalitions_users = await self._not_found_guard(login=login, loader=lambda: self._request(endpoint))
+        return self._prune(data=coalitions_users, fields=COALITION_USER_FIELDS)
 
     @cache(ttl=300)
     async def get_peer_locations(self, login: str, all_locations: bool) -> List[Dict[str, Any]]:
         endpoint = f'users/{login}/locations'
         if not all_locations:
-            return await self._request(endpoint, params={'per_page': 50})
-        locations = []
-        page = 1
+            locations = await self._not_found_guard(
+                login=login, loader=lambda: self._request(endpoint, params={'per_page': 50}))
+        else:
+            locations = await self._not_found_guard(
+                login=login, loader=lambda: self._get_pages(endpoint, params={'per_page': 100}))
+        return self._prune(data=locations, fields=LOCATION_FIELDS)
+
+    async def get_peer_locations_since(self, login: str, begin_at: str) -> List[Dict[str, Any]]:
+        endpoint = f'users/{login}/locations'
         params = {
-            'page': page,
-            'per_page': 100
+            'per_page': 100,
+            'range[begin_at]': f'{begin_at},{datetime.now(timezone("UTC")).isoformat()}'
         }
-        data = await self._request(endpoint, params=params)
-        locations.extend(data)
-        while data:
-            page += 1
-            params['page'] = page
-            data = await self._request(endpoint, params=params)
-            locations.extend(data)
-        return locations
+        return await self._not_found_guard(login=login, loader=lambda: self._get_pages(endpoint, params=params))
 
     @cache(ttl=3600)
+    async def get_peers_coalitions(self, peer_ids: List[int]) -> List[Dict[str, Any]]:
+        endpoint = 'coalitions_users'
+        coalitions_users = await self._request(endpoint, params={'filter[user_id]': ','.join(map(str, peer_ids)),
+                                                                 'per_page': 100})
+        return self._prune(data=coalitions_users, fields=COALITION_USER_FIELDS)
+
+    @cache(ttl=300)
+    async def get_peers_locations(self, peer_ids: List[int]) -> List[Dict[str, Any]]:
+        endpoint = 'locations'
+        locations = await self._request(endpoint, params={'filter[user_id]': ','.join(map(str, peer_ids)),
+                                                          'per_page': 100})
+        return self._prune(data=locations, fields=LOCATION_FIELDS)
+
+    @cache(ttl=3600, stale_ttl=86400)
     async def get_peer_feedbacks(self, login: str) -> List[Dict[str, Any]]:
         endpoint = f'users/{login}/scale_teams/as_corrector'
-        return await self._request(endpoint, params={'per_page': 50})
+        return await self._not_found_guard(login=login, loader=lambda: self._request(endpoint, params={'per_page': 50}))
 
     async def get_coalition(self, coalition_id: int) -> Dict[str, Any]:
         endpoint = f'coalitions/{coalition_id}'
@@ -205,7 +357,8 @@ class IntraAPI:
     @cache(ttl=300)
     async def get_location_history(self, host: str) -> List[Dict[str, Any]]:
         endpoint = 'locations'
-        return await self._request(endpoint, params={'filter[host]': host, 'per_page': 10})
+        locations = await self._request(endpoint, params={'filter[host]': host, 'per_page': 10})
+        return self._prune(data=locations, fields=LOCATION_FIELDS)
 
     async def get_campus(self, campus_id: int) -> Dict[str, Any]:
         endpoint = f'campus/{campus_id}'
@@ -242,7 +395,7 @@ class IntraAPI:
                 exams_ids.append(exam['id'])
         return exams_data
 
-    @cache(ttl=3600)
+    @cache(ttl=3600, stale_ttl=86400)
     async def get_project_peers(self, project_id: int, campus_id: int,
                                 time_zone: str) -> Tuple[int, List[Dict[str, Any]]]:
         endpoint = f'projects/{project_id}/projects_users'
@@ -272,63 +425,50 @@ class IntraAPI:
                 ids.remove(project['id'])
         return weeks_count, projects
 
-    @cache(ttl=300)
-    async def get_campus_locations(self, campus_id: int,
-                                   time_zone: str) -> Tuple[float, List[Dict[str, Any]], List[Dict[str, Any]]]:
+    async def get_campus_inactive_locations(self, campus_id: int, begin_at: datetime,
+                                            end_at: datetime) -> List[Dict[str, Any]]:
         endpoint = f'campus/{campus_id}/locations'
-
-        now = datetime.now(timezone(time_zone))
-        past = now - timedelta(hours=24)
-
-        scan = datetime.now().timestamp()
-        inactive = []
-        page = 1
         params = {
             'sort': '-end_at',
             'filter[inactive]': 'true',
             'per_page': 100,
-            'range[end_at]': f'{past},{now}',
-            'page': page
+            'range[end_at]': f'{begin_at},{end_at}'
         }
-        data = await self._request(endpoint, params=params)
-        while data and page <= 8:
-            page += 1
-            inactive.extend(data)
-            params['page'] = page
-            data = await self._request(endpoint, params=params)
+        return await self._get_pages(endpoint, params=params, max_pages=8)
 
-        active = []
-        page = 1
+    async def get_campus_locations_window(self, campus_id: int, field: str, begin_at: datetime,
+                                          end_at: datetime) -> List[Dict[str, Any]]:
+        endpoint = f'campus/{campus_id}/locations'
         params = {
-            'filter[active]': 'true',
             'per_page': 100,
-            'page': page
+            f'range[{field}]': f'{begin_at},{end_at}'
         }
-        data = await self._request(endpoint, params=params)
-        while data:
-            page += 1
-            active.extend(data)
-            params['page'] = page
-            data = await self._request(endpoint, params=params)
-        return scan, active, inactive
+        return await self._get_pages(endpoint, params=params)
+
+    async def get_campus_active_locations(self, campus_id: int) -> List[Dict[str, Any]]:
+        endpoint = f'campus/{campus_id}/locations'
+        params = {
+            'sort': 'id',
+            'filter[active]': 'true',
+            'per_page': 100
+        }
+        return await self._get_pages(endpoint, params=params)
 
     async def get_projects(self, cursus_id: int, project_names: List[str]) -> List[Dict[str, Any]]:
         endpoint = f'cursus/{cursus_id}/projects'
         projects = []
-        start = 0
-        stop = 100
-        while start < 200:
+        requests = []
+        for start in range(0, min(len(project_names), 200), 100):
             params = {
                 'per_page': 100,
                 'sort': 'name',
-                'filter[name]': ','.join(project_names[start:stop])
+                'filter[name]': ','.join(project_names[start:start + 100])
             }
-            data = await self._request(endpoint, params=params)
+            requests.append(self._request(endpoint, params=params))
+        for data in await asyncio.gather(*requests):
             for project in data:
                 if project['name'] in project_names:
                     if project['parent']:
-                        project['name'] = f"{project['parent']}: {project['name']}"
+                        project = {**project, 'name': f"{project['parent']}: {project['name']}"}
                     projects.append(project)
-            start += 100
-            stop += 100
         return projects
@@ -0,0 +1,175 @@
+import asyncio
+import time
+from contextlib import suppress
+from contextvars import ContextVar
+from datetime import (datetime,
+                      timezone)
+from enum import IntEnum
+from typing import (Dict,
+                    Iterable,
+                    List,
+                    Mapping)
+
+from aiocache.backends.redis import RedisCache
+
+ACQUIRE_SCRIPT = '''
+local now = tonumber(ARGV[1])
+local reserve = tonumber(ARGV[2])
+local hourly_share = tonumber(ARGV[3])
+local best = 0
+local best_tokens = 0
+local wait = -1
+local states = {}
+for i = 1, #KEYS / 2 do
+    local bucket = KEYS[i * 2 - 1]
+    local ledger = KEYS[i * 2]
+    local rate = tonumber(ARGV[i * 2 + 2])
+    local hourly = tonumber(ARGV[i * 2 + 3])
+    local state = redis.call('HMGET', bucket, 'tokens', 'updated_at', 'blocked_until')
+    local tokens = tonumber(state[1]) or rate
+    local updated_at = tonumber(state[2]) or now
+    local blocked_until = tonumber(state[3]) or 0
+    tokens = math.min(rate, tokens + math.max(now - updated_at, 0) * rate)
+    states[i] = tokens
+    local used = tonumber(redis.call('GET', ledger)) or 0
+    local needed = 1 + math.min(reserve, math.max(rate - 1, 0))
+    local delay = 0
+    if blocked_until > now then
+        delay = blocked_until - now
+    elseif used >= hourly * hourly_share then
+        delay = 3600 - now % 3600
+    elseif tokens < needed then
+        delay = (needed - tokens) / rate
+    elseif tokens > best_tokens then
+        best = i
+        best_tokens = tokens
+    end
+    if delay > 0 and (wait < 0 or delay < wait) then
+        wait = delay
+    end
+end
+for i = 1, #KEYS / 2 do
+    local tokens = states[i]
+    if i == best then
+        tokens = tokens - 1
+        redis.call('INCR', KEYS[i * 2])
+        redis.call('EXPIRE', KEYS[i * 2], 7200)
+    end
+    redis.call('HMSET', KEYS[i * 2 - 1], 'tokens', tostring(tokens), 'updated_at', ARGV[1])
+    redis.call('EXPIRE', KEYS[i * 2 - 1], 3600)
+end
+return {best, tostring(wait)}
+'''
+
+UPDATE_SCRIPT = '''
+local secondly_remaining = tonumber(ARGV[1])
+local hourly_used = tonumber(ARGV[2])
+local blocked_until = tonumber(ARGV[3])
+if secondly_remaining >= 0 then
+    local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+    if tokens == nil or tokens > secondly_remaining then
+        redis.call('HSET', KEYS[1], 'tokens', tostring(secondly_remaining))
+    end
+end
+if hourly_used >= 0 and hourly_used > (tonumber(redis.call('GET', KEYS[2])) or 0) then
+    redis.call('SET', KEYS[2], hourly_used, 'EX', 7200)
+end
+if blocked_until > (tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0) then
+    redis.call('HSET', KEYS[1], 'blocked_until', tostring(blocked_until))
+end
+redis.call('EXPIRE', KEYS[1], 3600)
+return 1
+'''
+
+
+class Lane(IntEnum):
+    interactive = 0
+    notification = 1
+    maintenance = 2
+
+
+lane: ContextVar[Lane] = ContextVar('lane', default=Lane.interactive)
+
+
+class RateLimiter:
+    reserves = {
+        Lane.interactive: (0, 1.0),
+        Lane.notification: (0.5, 0.9),
+        Lane.maintenance: (1, 0.8)
+    }
+
+    def __init__(self, redis: RedisCache, secondly_limit: int = 2, hourly_limit: int = 1200):
+        self._redis = redis
+        self._secondly_limit = secondly_limit
+        self._hourly_limit = hourly_limit
+        self._limits: Dict[int, List[int]] = {}
+        self._waiting: Dict[Lane, int] = {current_lane: 0 for current_lane in Lane}
+
+    def _is_preempted(self, current_lane: Lane) -> bool:
+        return any(self._waiting[other_lane] for other_lane in Lane if other_lane < current_lane)
+
+    @staticmethod
+    def _bucket_key(application_id: int) -> str:
+        return f'RateLimit:{application_id}'
+
+    @staticmethod
+    def _ledger_key(application_id: int, now: float) -> str:
+        return f'RateLimit:{application_id}:hour:{datetime.fromtimestamp(now, timezone.utc):%Y%m%d%H}'
+
+    def load(self, application_ids: Iterable[int]):
+        self._limits = {application_id: self._limits.get(application_id) or [self._secondly_limit, self._hourly_limit]
+                        for application_id in application_ids}
+
+    async def acquire(self) -> int:
+        current_lane = lane.get()
+        reserve, hourly_share = self.reserves[current_lane]
+        application_ids = list(self._limits)
+        self._waiting[current_lane] += 1
+        try:
+            while True:
+                if self._is_preempted(current_lane=current_lane):
+                    await asyncio.sleep(0.1)
+                    continue
+                now = time.time()
+                keys = []
+                args = [now, reserve, hourly_share]
+                for application_id in application_ids:
+                    keys.extend((self._bucket_key(application_id=application_id),
+                                 self._ledger_key(application_id=application_id, now=now)))
+                    args.extend(self._limits[application_id])
+                index, wait = await self._redis.raw('eval', ACQUIRE_SCRIPT, keys=keys, args=args)
+                if index:
+                    return application_ids[index - 1]
+                await asyncio.sleep(max(float(wait), 0.05))
+        finally:
+            self._waiting[current_lane] -= 1
+
+    async def _update(self, application_id: int, secondly_remaining: int = -1, hourly_used: int = -1,
+                      blocked_until: float = 0):
+        now = time.time()
+        keys = [self._bucket_key(application_id=application_id),
+                self._ledger_key(application_id=application_id, now=now)]
+        await self._redis.raw('eval', UPDATE_SCRIPT, keys=keys, args=[secondly_remaining, hourly_used, blocked_until])
+
+    async def update(self, application_id: int, headers: Mapping[str, str]):
+        limits = self._limits[application_id]
+        secondly_remaining = hourly_used = -1
+        with suppress(KeyError, ValueError):
+            limits[0] = int(headers['X-Secondly-RateLimit-Limit'])
+            secondly_remaining = int(headers['X-Secondly-RateLimit-Remaining'])
+        with suppress(KeyError, ValueError):
+            limits[1] = int(headers['X-Hourly-RateLimit-Limit'])
+            hourly_used = limits[1] - int(headers['X-Hourly-RateLimit-Remaining'])
+        await self._update(application_id=application_id, secondly_remaining=secondly_remaining,
+                           hourly_used=hourly_used)
+
+    async def block(self, application_id: int, seconds: float):
+        await self._update(application_id=application_id, blocked_until=time.time() + seconds)
+
+    async def ledger(self) -> Dict[int, int]:
+        now = time.time()
+        ledger = {}
+        for application_id in self._limits:
+            used = await self._redis.raw('get', self._ledger_key(application_id=application_id, now=now))
+            ledger[application_id] = int(used or 0)
+        return ledger
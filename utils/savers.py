@@ -22,8 +22,7 @@ class Savers:
             updates.update({'cursus_id': cursus_id})
         if updates:
             peer = await Peer.update_peer(peer_id=peer_id, **updates)
-            keys = [f'User.get_user_from_peer:{peer_id}', f'User.get_user_data:{user_id}']
-            [await Cache().delete(key=key) for key in keys]
+            await Cache().delete_many(keys=[f'User.get_user_from_peer:{peer_id}'], tags=[f'User:{peer.user_id}'])
         if not peer:
             peer = await Peer.create_peer(peer_id=peer_id, login=login, cursus_id=cursus_id,
                                           campus_id=campus_id, user_id=user_id)
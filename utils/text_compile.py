@@ -23,6 +23,7 @@ from models.feedback import Feedback
 from models.host import Host
 from models.peer import Peer
 from models.project import Project
+from models.time_stats import TimeStats
 from utils.cache import Cache
 from utils.intra_api import (UnknownIntraError,
                              TimeoutIntraError,
@@ -132,6 +133,23 @@ class TextCompile:
         peer = await self._get_peer(user=user, login=login)
         if isinstance(peer, str):
             return None, peer
+        return peer, self._peer_text_compile(user=user, peer=peer, is_single=is_single)
+
+    async def peers_data_compile(self, user: User, peers: List[PeerDB]) -> List[Tuple[Union[Peer, None], str]]:
+        results = await Peer().get_peers(peers=peers)
+        data = []
+        for peer_db, peer in zip(peers, results):
+            if isinstance(peer, (UnknownIntraError, TimeoutIntraError)):
+                data.append((None, f'{hbold(peer_db.login, ":", sep="")} {peer}'))
+            elif isinstance(peer, NotFoundIntraError):
+                data.append((None, Config.local.not_found.get(user.language, login=peer_db.login.replace("<", "&lt"))))
+            elif isinstance(peer, Exception):
+                raise peer
+            else:
+                data.append((peer, self._peer_text_compile(user=user, peer=peer, is_single=False)))
+        return data
+
+    def _peer_text_compile(self, user: User, peer: Peer, is_single: bool) -> str:
         courses = '\n'.join([f'{hbold(cursus.name, ":", sep="")} {cursus.level}' for cursus in peer.cursus_data])
         coalition = ''
         if peer.coalition:
@@ -172,8 +190,7 @@ class TextCompile:
                f'{courses}\n' \
                f'{campus}' \
                f'{location}'
-        text = hide_link(url=peer.avatar) + text
-        return peer, text
+        return hide_link(url=peer.avatar) + text
 
     async def peer_locations_compile(self, user: User, login: str, page: int = 0,
                                      message_text: str = None) -> Tuple[str, int, bool]:
@@ -289,30 +306,15 @@ class TextCompile:
     async def free_locations_compile(self, user: User, campus_id: int, page: int = 0) -> Tuple[str, int, int]:
         campus = await self._get_campus(campus_id=campus_id)
         try:
-            scan, active, inactive = await Config.intra.get_campus_locations(campus_id=campus_id,
-                                                                             time_zone=campus.time_zone)
+            scan, active, count, page, locations = await Config.sub_apps.free_locations.get_page(campus_id=campus_id,
+                                                                                                page=page)
         except (UnknownIntraError, NotFoundIntraError, TimeoutIntraError) as e:
             return f'{hbold(campus.name, ":", sep="")} {e}', 0, 0
-        locations = {}
-        for location in inactive:
-            if location['host'] not in locations:
-                locations.update({location['host']: location})
-        for location in active:
-            locations.pop(location['host'], '')
-        locations = list(locations.items())[:400]
-        locations.sort()
-        active = len(active)
         now = self._get_str_time(datetime.fromtimestamp(scan).isoformat(), campus.time_zone)
-        count = len(locations[page * 40:])
-        while not count and page:
-            page -= 1
-            count = len(locations[page * 40:])
-        locations = paginate(data=locations, page=page, limit=40)
         texts = []
-        for data in locations:
-            location = Host.from_dict(data=data[1])
-            end_at = self._get_str_time(iso_format=location.end_at, time_zone=campus.time_zone)
-            text = f'{hcode(location.host)}  |  {hcode(location.login)}  |  {end_at}'
+        for host, login, end_at in locations:
+            end_at = self._get_str_time(iso_format=end_at, time_zone=campus.time_zone)
+            text = f'{hcode(host)}  |  {hcode(login)}  |  {end_at}'
             texts.append(text)
         body = Config.local.locations_disclaimer.get(user.language)
         if texts:
@@ -377,7 +379,7 @@ class TextCompile:
         if is_wrong:
             return Config.local.not_found.get(user.language, login=is_wrong.replace("<", "&lt")), False
         try:
-            data = await Host().get_peer_locations(login=login, all_locations=True)
+            stats = await TimeStats().get_time_stats(login=login)
             peer = await Peer().get_peer(login=login, extended=False)
             title = self._get_peer_title(status=peer.status, url=peer.link,
                                          full_name=peer.full_name, login=peer.login)
@@ -385,22 +387,10 @@ class TextCompile:
             return f'{hbold(login, ":", sep="")} {e}', False
         except NotFoundIntraError:
             return Config.local.not_found.get(user.language, login=login.replace("<", "&lt")), False
-        if not data:
+        if not stats.hosts:
             return Config.local.not_logged.get(user.language, title=title), True
-        total_seconds = 0
-        locations = {}
-        maximum = {'seconds': 0}
-        for location in data:
-            seconds = self._get_seconds(end_at=location.end_at, begin_at=location.begin_at)
-            if maximum['seconds'] < seconds:
-                maximum.update({
-                    'host': location.host, 'campus_id': location.campus_id, 'seconds': seconds,
-                    'end_at': location.end_at, 'begin_at': location.begin_at
-                })
-            locations.setdefault(location.host, {'seconds': 0, 'campus_id': location.campus_id})
-            locations[location.host]['seconds'] += seconds
-            total_seconds += seconds
-        time_gone = self._get_time_gone(user=user, seconds=total_seconds)
+        maximum = stats.maximum
+        time_gone = self._get_time_gone(user=user, seconds=stats.total)
         total_time = Config.local.total_time.get(user.language, total=time_gone)
         max_time_campus = await self._get_campus(campus_id=maximum['campus_id'])
         max_time_log = self._get_log_time(begin_at_iso=maximum['begin_at'], end_at_iso=maximum['end_at'],
@@ -408,7 +398,7 @@ class TextCompile:
         max_time_total = self._get_time_gone(user=user, seconds=maximum['seconds'])
         max_time = Config.local.max_time.get(user.language, campus=hbold(max_time_campus.name),
                                              host=hcode(maximum['host']), log_time=max_time_log, total=max_time_total)
-        locations = sorted(locations.items(), key=lambda tup: (tup[1]['seconds']), reverse=True)[:10]
+        locations = sorted(stats.hosts.items(), key=lambda tup: (tup[1]['seconds']), reverse=True)[:10]
         texts = []
         for location in locations:
             campus = await self._get_campus(campus_id=location[1]['campus_id'])
@@ -425,7 +415,7 @@ class TextCompile:
         try:
             events_data = await Config.intra.get_events(campus_id=campus_id, cursus_id=cursus_id)
             exams_data = await Config.intra.get_exams(campus_id=campus_id, cursus_id=cursus_id)
-            events_data.extend(exams_data)
+            events_data = [*events_data, *exams_data]
         except (UnknownIntraError, NotFoundIntraError, TimeoutIntraError) as e:
             return f'{hbold(campus.name, ":", sep="")} {e}', 0, 0
         if not events_data:
@@ -513,16 +503,25 @@ class TextCompile:
                 logins.remove(login)
                 bad_logins.append(is_wrong)
         bad_logins = list(dict.fromkeys(bad_logins))
+        known_logins = Config.sub_apps.known_logins
+        for login in logins.copy():
+            if await known_logins.is_not_found(login=login):
+                logins.remove(login)
+                bad_logins.append(login)
         if len(logins) < 2:
             return logins, bad_logins
+        if all(login in known_logins for login in logins):
+            return list(dict.fromkeys(logins)), bad_logins
         try:
             peers = await Config.intra.get_peers(logins=logins)
         except (UnknownIntraError, TimeoutIntraError):
             return logins, bad_logins
         peer_logins = [peer['login'] for peer in peers]
+        known_logins.add(logins=peer_logins)
         for login in logins:
             if login not in peer_logins:
                 bad_logins.append(login)
+                await Config.intra.set_not_found(login=login)
         peer_logins.sort()
         return peer_logins, bad_logins
 